@@ -10,7 +10,12 @@ class Agent(ABC):
     """
     Clase base abstracta para todos los agentes.
     Asegura que todos los agentes implementen los métodos principales.
+
+    Declara `__slots__` vacío para que las subclases que definan sus propios
+    `__slots__` no arrastren un `__dict__` por instancia.
     """
+
+    __slots__ = ()
     
     @abstractmethod
     def run(self) -> None:
@@ -9,25 +9,14 @@
 # - ✅ Respeto total del patrón LangGraph
 # -----------------------------------------------------------------------------
 
-from langgraph.graph import StateGraph, END
+from functools import lru_cache
 
 # Imports del proyecto
+# NOTA: langgraph y los nodos (que arrastran langchain_openai) se importan
+# dentro de build_graph() para no pagar su costo al importar este módulo.
 from agents.graph_state import GraphState
 from utils.logger import setup_logger
 
-# Importar TODOS los nodos que usará el grafo
-from agents.nodes import (
-    load_context,
-    extract_principles,
-    generate_routine,
-    save_routine,
-    handle_error,
-)
-from agents.nodes.legacy import (
-    call_legacy_register,
-    call_legacy_query
-)
-
 logger = setup_logger(__name__)
 
 
@@ -35,6 +24,13 @@ logger = setup_logger(__name__)
 # FUNCIONES DE ROUTING (DECISIÓN) - SOLO LECTURA
 # -----------------------------------------------------------------------------
 
+# Tabla de despacho: request_type -> siguiente nodo (Router 1)
+REQUEST_TYPE_ROUTES = {
+    "crear_rutina": "extract_principles",
+    "registrar_ejercicio": "call_legacy_register",
+    "consultar_historial": "call_legacy_query",
+}
+
 def route_after_load(state: GraphState) -> str:
     """
     Router 1: Decide qué flujo tomar después de cargar el contexto.
@@ -46,26 +42,23 @@ def route_after_load(state: GraphState) -> str:
         str: Nombre del siguiente nodo a ejecutar
     """
     # Si hay error previo, ir a manejo de errores
-    if state.get("error"):
-        logger.warning(f"Error detectado en load_context: {state['error']}")
+    error = state.get("error")
+    if error:
+        logger.warning(f"Error detectado en load_context: {error}")
         return "handle_error"
 
-    request_type = state.get("request_type", "unknown")
+    request_type = state.get("request_type")
     logger.info(f"Routing after load, request_type: {request_type}")
     
     # Rutear según tipo de request
-    if request_type == "crear_rutina":
-        return "extract_principles"
-    elif request_type == "registrar_ejercicio":
-        return "call_legacy_register"
-    elif request_type == "consultar_historial":
-        return "call_legacy_query"
-    else:
+    next_node = REQUEST_TYPE_ROUTES.get(request_type)
+    if next_node is None:
         # Caso de request_type desconocido
         # NOTA: El nodo load_context ahora valida esto y setea el error
         # Si llegamos aquí con "unknown", load_context ya debe haberlo manejado
         logger.info(f"Routing unknown request_type '{request_type}' to error handler")
         return "handle_error"
+    return next_node
 
 
 def route_after_extract(state: GraphState) -> str:
@@ -83,8 +76,9 @@ def route_after_extract(state: GraphState) -> str:
         str: Nombre del siguiente nodo a ejecutar
     """
     # Si el nodo extract_principles detectó algún error, rutear a handle_error
-    if state.get("error"):
-        logger.warning(f"Error detectado en extract_principles: {state['error']}")
+    error = state.get("error")
+    if error:
+        logger.warning(f"Error detectado en extract_principles: {error}")
         return "handle_error"
     
     # Si no hay error, los principios están validados
@@ -107,8 +101,9 @@ def route_after_generate(state: GraphState) -> str:
         str: Nombre del siguiente nodo a ejecutar
     """
     # Si el nodo generate_routine detectó algún error, rutear a handle_error
-    if state.get("error"):
-        logger.warning(f"Error detectado en generate_routine: {state['error']}")
+    error = state.get("error")
+    if error:
+        logger.warning(f"Error detectado en generate_routine: {error}")
         return "handle_error"
     
     # Si no hay error, la rutina está validada
@@ -120,16 +115,35 @@ def route_after_generate(state: GraphState) -> str:
 # CONSTRUCTOR DEL GRAFO
 # -----------------------------------------------------------------------------
 
+@lru_cache(maxsize=1)
 def build_graph():
     """
     Construye y compila el StateGraph C-R-G + Legacy.
 
+    El resultado se memoiza: la topología no depende de la configuración
+    (modelos, rutas), así que el grafo se compila una sola vez por proceso.
+
     Returns:
         Grafo compilado y listo para invocar.
         
     Raises:
         Exception: Si el grafo no puede compilarse.
     """
+    from langgraph.graph import StateGraph, END
+
+    # Importar TODOS los nodos que usará el grafo
+    from agents.nodes import (
+        load_context,
+        extract_principles,
+        generate_routine,
+        save_routine,
+        handle_error,
+    )
+    from agents.nodes.legacy import (
+        call_legacy_register,
+        call_legacy_query
+    )
+
     logger.info("Construyendo el grafo de LangGraph...")
     
     # 1. Crear instancia del StateGraph
@@ -208,5 +222,13 @@ def build_graph():
 # EXPORTACIÓN
 # -----------------------------------------------------------------------------
 
-# Instancia global, compilada y lista para ser importada por main.py
-graph = build_graph()
\ No newline at end of file
+def __getattr__(name: str):
+    """
+    Exporta `graph` de forma perezosa (PEP 562).
+
+    `from agents.entrenador import graph` sigue funcionando, pero la
+    compilación se difiere al primer acceso en lugar de al importar el módulo.
+    """
+    if name == "graph":
+        return build_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -6,7 +6,9 @@ Cada nodo recibe un GraphState, lo modifica, y retorna un GraphState actualizado
 
 IMPORTANTE: Usar TypedDict en lugar de Pydantic para compatibilidad con LangGraph.
 """
-from typing import TypedDict, Optional, Dict, Any, List
+from datetime import datetime, timezone
+from operator import itemgetter
+from typing import TypedDict, NamedTuple, Optional, Dict, Any, get_type_hints
 
 
 class GraphState(TypedDict, total=False):
@@ -50,6 +52,17 @@ class GraphState(TypedDict, total=False):
     a través del grafo. Sin él, los nodos legacy reciben cadena vacía.
     """
     
+    ejercicio_data: Optional[Dict[str, Any]]
+    """
+    Ejercicio ya estructurado (opcional), para productores que no envían texto libre.
+    Estructura: {ejercicio, series, repeticiones, peso_kg} (o un EjercicioEstructurado)
+    Usado por:
+    - agents/nodes/legacy.py: si está presente, call_legacy_register lo registra
+      directamente sin parsear user_message (ni regex ni LLM)
+    
+    Ejemplo: {'ejercicio': 'sentadilla', 'series': 5, 'repeticiones': 5, 'peso_kg': 100.0}
+    """
+    
     # ========================================
     # PASO C: CONTEXTO (llenado por load_context)
     # ========================================
@@ -141,7 +154,7 @@ class GraphState(TypedDict, total=False):
     """
     
     timestamp: str
-    """Timestamp ISO de cuándo se inició el flujo (para logging)"""
+    """Timestamp ISO (UTC) de cuándo se inició el flujo (para logging)"""
     
     # ========================================
     # METADATA (OPCIONAL)
@@ -153,10 +166,26 @@ class GraphState(TypedDict, total=False):
     """
 
 
+# Type hints resueltos una sola vez (get_type_hints es costoso en cada llamada)
+GRAPHSTATE_HINTS: Dict[str, Any] = get_type_hints(GraphState)
+
+
 # ============================================================================
 # FUNCIONES DE UTILIDAD
 # ============================================================================
 
+def _utcnow_iso() -> str:
+    """Timestamp ISO en UTC con precisión de segundos (solo para logging)."""
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+# Plantilla con todos los campos ya inicializados; create_initial_state la copia.
+# Campos `str` arrancan como "" y el resto (Optional[...]) como None.
+_INITIAL_TEMPLATE: GraphState = GraphState(
+    **{field: "" if hint is str else None for field, hint in GRAPHSTATE_HINTS.items()}
+)
+
+
 def create_initial_state(user_id: str, request_type: str = "crear_rutina") -> GraphState:
     """
     Crea el estado inicial del grafo.
@@ -168,25 +197,30 @@ def create_initial_state(user_id: str, request_type: str = "crear_rutina") -> Gr
     Returns:
         GraphState inicial con solo inputs poblados
     """
-    from datetime import datetime
-    
-    return GraphState(
-        user_id=user_id,
-        request_type=request_type,
-        user_message=None,  # ✅ Inicializar explícitamente
-        perfil_usuario=None,
-        preferencias_logistica=None,
-        principios_libro=None,
-        rutina_final=None,
-        step_completed="",
-        error=None,
-        timestamp=datetime.now().isoformat(),
-        debug_info=None,
-        respuesta_usuario=""  # ✅ Inicializar explícitamente
-    )
+    # ✅ Todos los campos declarados se inicializan explícitamente
+    state = _INITIAL_TEMPLATE.copy()
+    state["user_id"] = user_id
+    state["request_type"] = request_type
+    state["timestamp"] = _utcnow_iso()
+    return state
+
+
+# Inputs obligatorios, leídos en una sola llamada por is_state_valid
+_REQUIRED_INPUTS = ("user_id", "request_type")
+_get_required_inputs = itemgetter(*_REQUIRED_INPUTS)
+
 
+class ValidationResult(NamedTuple):
+    """Resultado de is_state_valid: desempaquetable como (ok, err)."""
+    ok: bool
+    err: Optional[str]
 
-def is_state_valid(state: GraphState) -> tuple[bool, Optional[str]]:
+
+# Resultado de éxito compartido: permite `is_state_valid(s) is VALID_OK`
+VALID_OK = ValidationResult(True, None)
+
+
+def is_state_valid(state: GraphState) -> ValidationResult:
     """
     Valida que el estado tenga campos requeridos.
     
@@ -194,20 +228,27 @@ def is_state_valid(state: GraphState) -> tuple[bool, Optional[str]]:
         state: Estado a validar
     
     Returns:
-        (is_valid, error_message)
+        ValidationResult(ok, err); en éxito siempre el singleton VALID_OK
     """
     # Validar inputs
-    if not state.get("user_id"):
-        return False, "user_id es requerido"
+    try:
+        user_id, request_type = _get_required_inputs(state)
+    except KeyError:
+        user_id = state.get("user_id")
+        request_type = state.get("request_type")
+
+    if not user_id:
+        return ValidationResult(False, "user_id es requerido")
     
-    if not state.get("request_type"):
-        return False, "request_type es requerido"
+    if not request_type:
+        return ValidationResult(False, "request_type es requerido")
     
     # Si hay error, verificar que step_completed sea 'error'
-    if state.get("error") and state.get("step_completed") != "error":
-        return False, "Estado inconsistente: hay error pero step_completed no es 'error'"
+    error = state.get("error")
+    if error and state.get("step_completed") != "error":
+        return ValidationResult(False, "Estado inconsistente: hay error pero step_completed no es 'error'")
     
-    return True, None
+    return VALID_OK
 
 
 # ============================================================================
@@ -216,6 +257,9 @@ def is_state_valid(state: GraphState) -> tuple[bool, Optional[str]]:
 
 __all__ = [
     "GraphState",
+    "GRAPHSTATE_HINTS",
     "create_initial_state",
-    "is_state_valid"
+    "is_state_valid",
+    "ValidationResult",
+    "VALID_OK",
 ]
\ No newline at end of file
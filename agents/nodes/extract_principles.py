@@ -1,13 +1,236 @@
-from typing import Dict, Any
+import logging
+import os
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+
+from pydantic import ValidationError
 
 # LangChain and Project Imports
 from agents.graph_state import GraphState
 from rag.principle_extractor import PrincipleExtractor
 from rag.models import PrincipiosExtraidos
-from utils.logger import setup_logger
+from utils.logger import log_node, setup_logger
 
 logger = setup_logger(__name__)
 
+# Campos del perfil que realmente usa la cadena RAG (query + prompt).
+# El resto del perfil (nombre, fechas, favoritos...) no afecta el resultado.
+RAG_PROFILE_FIELDS = ("level", "objetivo", "restricciones")
+
+# Tipo de la clave de caché: ((campo, valor_normalizado), ...)
+PerfilKey = Tuple[Tuple[str, Any], ...]
+
+
+class _RejectedExtraction(Exception):
+    """
+    Resultado del RAG que no debe cachearse (nulo o sin citas).
+
+    lru_cache no memoiza excepciones, así que se usa para devolver el
+    resultado al nodo sin que quede guardado en la caché.
+    """
+
+    def __init__(self, principios: Optional[PrincipiosExtraidos]):
+        super().__init__("Extracción rechazada")
+        self.principios = principios
+
+
+def _normalize(value: Any) -> Any:
+    """Normaliza strings (minúsculas, espacios colapsados) y listas a tuplas."""
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, (list, tuple)):
+        return tuple(_normalize(v) for v in value)
+    return value
+
+
+def _validate_perfil(perfil_usuario: Any) -> Optional[str]:
+    """
+    Valida la forma de los campos que consume la cadena RAG.
+
+    Chequeo liviano (sin Pydantic) para rechazar perfiles malformados antes
+    de la llamada costosa. Los campos ausentes se permiten: load_context ya
+    exige level/objetivo y el extractor tiene defaults.
+
+    Returns:
+        None si el perfil es válido, o un detalle del problema.
+    """
+    if not isinstance(perfil_usuario, dict):
+        return f"se esperaba un objeto, se recibió {type(perfil_usuario).__name__}"
+    for field in ("level", "objetivo"):
+        value = perfil_usuario.get(field)
+        if value is not None and not isinstance(value, str):
+            return f"'{field}' debe ser texto"
+    restricciones = perfil_usuario.get("restricciones")
+    if restricciones is not None and (
+        not isinstance(restricciones, (list, tuple))
+        or not all(isinstance(r, str) for r in restricciones)
+    ):
+        return "'restricciones' debe ser una lista de textos"
+    return None
+
+
+def _perfil_cache_key(perfil_usuario: Dict[str, Any]) -> PerfilKey:
+    """Construye una clave hashable con los campos relevantes del perfil."""
+    return tuple(
+        (field, _normalize(perfil_usuario[field]))
+        for field in RAG_PROFILE_FIELDS
+        if field in perfil_usuario
+    )
+
+
+def _perfil_from_key(perfil_key: PerfilKey) -> Dict[str, Any]:
+    """Reconstruye el perfil (input de la cadena) a partir de su clave."""
+    return {
+        field: list(value) if isinstance(value, tuple) else value
+        for field, value in perfil_key
+    }
+
+
+@lru_cache(maxsize=1)
+def _get_chain():
+    """
+    Construye la cadena RAG una sola vez por proceso.
+
+    PrincipleExtractor no guarda estado por llamada, así que el cliente LLM,
+    el prompt y el retriever se reutilizan entre invocaciones del nodo.
+    """
+    logger.info("Initializing PrincipleExtractor...")
+    extraction_chain = PrincipleExtractor().get_extraction_chain()
+    logger.info("Extraction chain obtained.")
+    return extraction_chain
+
+
+@lru_cache(maxsize=512)
+def _cached_extract(perfil_key: PerfilKey) -> PrincipiosExtraidos:
+    """
+    Ejecuta la cadena RAG para un perfil normalizado y memoiza el resultado.
+
+    Perfiles equivalentes (mismo nivel, objetivo y restricciones) comparten
+    los principios extraídos sin volver a llamar al retriever ni al LLM.
+
+    Raises:
+        _RejectedExtraction: Si el resultado es nulo o no tiene citas.
+    """
+    logger.info("Invoking principle extraction chain...")
+    principios: PrincipiosExtraidos = _get_chain().invoke(_perfil_from_key(perfil_key))
+    if not principios or not principios.citas_fuente:
+        raise _RejectedExtraction(principios)
+    return principios
+
+
+# Precalentamiento opcional: construir la cadena al importar (RAG_EAGER=1)
+# para no pagar la carga del vector store en la primera petición.
+if os.environ.get("RAG_EAGER"):
+    try:
+        _get_chain()
+    except Exception as e:
+        logger.warning("RAG eager warm-up failed, will retry lazily: %s", e)
+
+
+def _error_update(message: str) -> GraphState:
+    """Actualización parcial para los caminos de error del nodo."""
+    return {"error": message, "step_completed": "extract_principles_error"}
+
+
+def _check_perfil(perfil_usuario: Any) -> Optional[GraphState]:
+    """
+    VALIDACIÓN 1: perfil presente y bien tipado.
+
+    Returns:
+        None si el perfil es usable, o la actualización de error.
+    """
+    if not perfil_usuario:
+        logger.error("User profile ('perfil_usuario') is missing in state.")
+        return _error_update("Perfil de usuario no disponible para extraer principios.")
+
+    perfil_error = _validate_perfil(perfil_usuario)
+    if perfil_error:
+        logger.error("Invalid user profile: %s", perfil_error)
+        return _error_update(f"Perfil inválido: {perfil_error}")
+    return None
+
+
+def _principles_update(
+    state: GraphState, principios: Optional[PrincipiosExtraidos]
+) -> GraphState:
+    """
+    VALIDACIONES 2 y 3 sobre el resultado del RAG y armado de la actualización.
+
+    Args:
+      state (GraphState): Estado original (solo lectura).
+      principios: Resultado de la cadena RAG (puede ser None).
+
+    Returns:
+      GraphState: Actualización parcial de éxito o de error.
+    """
+    # ════════════════════════════════════════════════════════════════════
+    # VALIDACIÓN 2: Verificar que RAG retornó resultado válido
+    # ════════════════════════════════════════════════════════════════════
+    if not principios:
+        logger.error("PrincipleExtractor chain returned a null result.")
+        return _error_update("RAG retornó resultado nulo al extraer principios.")
+
+    # ════════════════════════════════════════════════════════════════════
+    # VALIDACIÓN 3: CRÍTICA - Verificar presencia de citas (anti-alucinación)
+    # ════════════════════════════════════════════════════════════════════
+    # Si no hay citas, el LLM pudo haber alucinado los principios.
+    # DEBE fallar aquí para prevenir rutinas basadas en datos inventados.
+    if not principios.citas_fuente:
+        logger.error("CRITICAL: Extracted principles lack source citations!")
+        update = _error_update("Alucinación detectada: principios extraídos sin citas de fuente.")
+        
+        # Guardar debug info para análisis posterior (solo en modo verbose)
+        debug_info = state.get("debug_info")
+        if debug_info is not None or os.environ.get("VERBOSE"):
+            update["debug_info"] = {
+                **(debug_info or {}),
+                "principles_without_citations": principios.model_dump(),
+            }
+        
+        return update
+
+    # ════════════════════════════════════════════════════════════════════
+    # PASO 3: Validaciones opcionales (confianza, si existe)
+    # ════════════════════════════════════════════════════════════════════
+    # Nota: PrincipiosExtraidos no tiene campo 'confianza' en el modelo actual
+    # Si se agrega en el futuro, descomentar:
+    #
+    # confidence = getattr(principios, 'confianza', 1.0)
+    # if confidence < 0.3:
+    #     logger.warning(f"Low confidence ({confidence:.2f}) in extracted principles for user {state.get('user_id')}")
+    #     update["debug_info"] = {**(state.get("debug_info") or {}),
+    #                             "low_confidence_principles": principios.model_dump()}
+
+    # ════════════════════════════════════════════════════════════════════
+    # ÉXITO: Guardar principios en estado
+    # ════════════════════════════════════════════════════════════════════
+    logger.info("Successfully extracted principles for user: %s", state.get("user_id"))
+    
+    # Log de auditoría (para debugging)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Extracted Principles Summary: RIR=%s, Reps=%s, ECIs=%d, Citations=%d",
+            principios.intensidad_RIR,
+            principios.rango_repeticiones,
+            len(principios.ECI_recomendados),
+            len(principios.citas_fuente),
+        )
+
+    return {"principios_libro": principios, "step_completed": "principles_extracted"}
+
+
+def _exception_update(e: Exception) -> GraphState:
+    """Traduce una excepción de la cadena RAG a actualización de error."""
+    if isinstance(e, ImportError):
+        # Error de dependencias faltantes
+        logger.error("Import error, likely missing RAG components: %s", e, exc_info=e)
+        return _error_update("Error de importación, componentes RAG podrían faltar.")
+    # Errores generales (API timeout, errores de LLM, etc.)
+    logger.error("Error invoking principle extraction chain: %s", e, exc_info=e)
+    return _error_update(f"Error de API o RAG al extraer principios: {str(e)}")
+
+
+@log_node("Extract Principles")
 def extract_principles(state: GraphState) -> GraphState:
     """
     Nodo: extract_principles
@@ -16,7 +239,7 @@ def extract_principles(state: GraphState) -> GraphState:
     basados en el perfil del usuario, asegurando que incluyan citas.
 
     VALIDACIONES CRÍTICAS:
-    1. Perfil de usuario presente en estado
+    1. Perfil de usuario presente en estado y con campos bien tipados
     2. RAG retorna resultado válido (no None)
     3. Principios contienen citas de fuente (anti-alucinación)
 
@@ -24,103 +247,92 @@ def extract_principles(state: GraphState) -> GraphState:
       state (GraphState): Estado con perfil_usuario lleno.
 
     Returns:
-      GraphState: Estado actualizado con principios_libro o error.
+      GraphState: Actualización PARCIAL (solo las claves modificadas:
+      principios_libro/step_completed o error/step_completed). LangGraph
+      la fusiona con el estado; el estado recibido no se muta.
 
     Raises:
-      Ninguno (errores van a state["error"]).
+      Ninguno (errores van a la clave "error" de la actualización).
     """
-    logger.info("--- Entering Extract Principles Node ---")
     perfil_usuario = state.get("perfil_usuario")
 
-    # ════════════════════════════════════════════════════════════════════
-    # VALIDACIÓN 1: Verificar que perfil_usuario existe
-    # ════════════════════════════════════════════════════════════════════
-    if not perfil_usuario:
-        logger.error("User profile ('perfil_usuario') is missing in state.")
-        state["error"] = "Perfil de usuario no disponible para extraer principios."
-        state["step_completed"] = "extract_principles_error"
-        return state
+    error_update = _check_perfil(perfil_usuario)
+    if error_update:
+        return error_update
+
+    # Fast path: principios ya presentes y con citas (p. ej. re-ejecución)
+    existing = state.get("principios_libro")
+    if isinstance(existing, dict):
+        # generate_routine necesita el modelo (model_dump_json), no el dict crudo
+        try:
+            existing = PrincipiosExtraidos.model_validate(existing)
+        except ValidationError as e:
+            logger.debug("Existing principios_libro is invalid, re-extracting: %s", e)
+            existing = None
+    if isinstance(existing, PrincipiosExtraidos) and existing.citas_fuente:
+        logger.debug("Principles already present; skipping re-extraction")
+        return {"principios_libro": existing, "step_completed": "principles_extracted"}
 
     try:
         # ════════════════════════════════════════════════════════════════
-        # PASO 1: Inicializar PrincipleExtractor
+        # PASO 1-2: Invocar cadena RAG (memoizada por perfil normalizado)
         # ════════════════════════════════════════════════════════════════
-        logger.info("Initializing PrincipleExtractor...")
-        extractor = PrincipleExtractor()
-        extraction_chain = extractor.get_extraction_chain()
-        logger.info("Extraction chain obtained. Invoking...")
+        try:
+            principios = _cached_extract(_perfil_cache_key(perfil_usuario))
+        except _RejectedExtraction as rejected:
+            principios = rejected.principios
+        return _principles_update(state, principios)
 
-        # ════════════════════════════════════════════════════════════════
-        # PASO 2: Invocar cadena RAG
-        # ════════════════════════════════════════════════════════════════
-        principios: PrincipiosExtraidos = extraction_chain.invoke(perfil_usuario)
+    except Exception as e:
+        return _exception_update(e)
 
-        # ════════════════════════════════════════════════════════════════
-        # VALIDACIÓN 2: Verificar que RAG retornó resultado válido
-        # ════════════════════════════════════════════════════════════════
-        if not principios:
-            logger.error("PrincipleExtractor chain returned a null result.")
-            state["error"] = "RAG retornó resultado nulo al extraer principios."
-            state["step_completed"] = "extract_principles_error"
-            return state
 
-        # ════════════════════════════════════════════════════════════════
-        # VALIDACIÓN 3: CRÍTICA - Verificar presencia de citas (anti-alucinación)
-        # ════════════════════════════════════════════════════════════════
-        # Si no hay citas, el LLM pudo haber alucinado los principios.
-        # DEBE fallar aquí para prevenir rutinas basadas en datos inventados.
-        if not principios.citas_fuente:
-            logger.error("CRITICAL: Extracted principles lack source citations!")
-            state["error"] = "Alucinación detectada: principios extraídos sin citas de fuente."
-            state["step_completed"] = "extract_principles_error"
-            
-            # Guardar debug info para análisis posterior
-            if state.get("debug_info") is None:
-                state["debug_info"] = {}
-            state["debug_info"]["principles_without_citations"] = principios.model_dump()
-            
-            return state
+def extract_principles_batch(
+    states: List[GraphState], max_concurrency: int = 8
+) -> List[GraphState]:
+    """
+    Variante por lotes de extract_principles para procesar varios usuarios.
 
-        # ════════════════════════════════════════════════════════════════
-        # PASO 3: Validaciones opcionales (confianza, si existe)
-        # ════════════════════════════════════════════════════════════════
-        # Nota: PrincipiosExtraidos no tiene campo 'confianza' en el modelo actual
-        # Si se agrega en el futuro, descomentar:
-        #
-        # confidence = getattr(principios, 'confianza', 1.0)
-        # if confidence < 0.3:
-        #     logger.warning(f"Low confidence ({confidence:.2f}) in extracted principles for user {state.get('user_id')}")
-        #     if state.get("debug_info") is None:
-        #         state["debug_info"] = {}
-        #     state["debug_info"]["low_confidence_principles"] = principios.model_dump()
+    Valida cada perfil, agrupa los perfiles equivalentes (misma clave
+    normalizada) y ejecuta la cadena RAG una vez por clave con
+    `chain.batch`, en paralelo hasta `max_concurrency`.
 
-        # ════════════════════════════════════════════════════════════════
-        # ÉXITO: Guardar principios en estado
-        # ════════════════════════════════════════════════════════════════
-        state["principios_libro"] = principios
-        state["step_completed"] = "principles_extracted"
-        logger.info(f"Successfully extracted principles for user: {state.get('user_id')}")
-        
-        # Log de auditoría (para debugging)
-        logger.debug(
-            f"Extracted Principles Summary: "
-            f"RIR={principios.intensidad_RIR}, "
-            f"Reps={principios.rango_repeticiones}, "
-            f"ECIs={len(principios.ECI_recomendados)}, "
-            f"Citations={len(principios.citas_fuente)}"
-        )
+    Args:
+      states: Estados con perfil_usuario lleno.
+      max_concurrency: Máximo de invocaciones simultáneas de la cadena.
 
-    except ImportError as e:
-        # Error de dependencias faltantes
-        logger.exception(f"Import error, likely missing RAG components: {e}")
-        state["error"] = "Error de importación, componentes RAG podrían faltar."
-        state["step_completed"] = "extract_principles_error"
-        
-    except Exception as e:
-        # Errores generales (API timeout, errores de LLM, etc.)
-        logger.exception(f"Error invoking principle extraction chain: {e}")
-        state["error"] = f"Error de API o RAG al extraer principios: {str(e)}"
-        state["step_completed"] = "extract_principles_error"
+    Returns:
+      List[GraphState]: Una actualización parcial por estado, en el mismo
+      orden, idéntica a la que retornaría extract_principles.
+    """
+    updates: List[Optional[GraphState]] = [None] * len(states)
+    pending: Dict[PerfilKey, List[int]] = {}
+
+    for i, state in enumerate(states):
+        perfil_usuario = state.get("perfil_usuario")
+        error_update = _check_perfil(perfil_usuario)
+        if error_update:
+            updates[i] = error_update
+        else:
+            pending.setdefault(_perfil_cache_key(perfil_usuario), []).append(i)
+
+    if pending:
+        keys = list(pending)
+        logger.info("Invoking principle extraction chain for %d profiles (batch)...", len(keys))
+        try:
+            results = _get_chain().batch(
+                [_perfil_from_key(key) for key in keys],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True,
+            )
+        except Exception as e:
+            results = [e] * len(keys)
+
+        for key, result in zip(keys, results):
+            for i in pending[key]:
+                if isinstance(result, Exception):
+                    updates[i] = _exception_update(result)
+                else:
+                    updates[i] = _principles_update(states[i], result)
 
-    logger.info("--- Exiting Extract Principles Node ---")
-    return state
\ No newline at end of file
+    return updates
@@ -1,8 +1,16 @@
+import hashlib
+import json
+import logging
+import os
 import time
+from collections import OrderedDict
+from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, List, NamedTuple, Tuple
 
 # LangChain Imports
+import openai
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
@@ -13,64 +21,190 @@ from langchain_core.runnables import RunnableSequence
 from agents.graph_state import GraphState
 from rag.models import RutinaActiva, Sesion, Ejercicio, PrincipiosExtraidos
 from config.settings import Config
-from utils.logger import setup_logger
+from utils.logger import log_node, setup_logger
 
 logger = setup_logger(__name__)
 
 # Constants
 MAX_RETRIES = 3
 
+# Errores transitorios que justifican reintentar (backoff exponencial con jitter)
+RETRYABLE_ERRORS = (
+    OutputParserException,
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+RETRY_JITTER_PARAMS = {"max": 8.0}
+JSON_RESPONSE_FORMAT = {"type": "json_object"}
+ROUTINE_CACHE_MAXSIZE = 64
+
+# Caché LRU en memoria de rutinas validadas: clave (principios, perfil, modelo) -> rutina serializada.
+# Con temperature=0.0 la salida es determinista para las mismas entradas.
+_ROUTINE_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def _routine_cache_key(principios_json: str, perfil: Dict[str, Any], model: str) -> str:
+    """Hash estable (blake2b) de las entradas que determinan la rutina generada."""
+    payload = json.dumps(
+        {"p": principios_json, "u": perfil, "m": model},
+        sort_keys=True, ensure_ascii=False, default=str,
+    )
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _get_cached_routine(key: str) -> RutinaActiva | None:
+    """Retorna una copia fresca de la rutina cacheada (con fecha_creacion actual) o None."""
+    cached = _ROUTINE_CACHE.get(key)
+    if cached is None:
+        return None
+    _ROUTINE_CACHE.move_to_end(key)
+    return RutinaActiva.model_validate({**cached, "fecha_creacion": datetime.now().isoformat()})
+
+
+def _store_cached_routine(key: str, rutina: RutinaActiva) -> None:
+    """Guarda una rutina ya validada, desalojando la menos usada si se excede el tamaño."""
+    _ROUTINE_CACHE[key] = rutina.model_dump()
+    _ROUTINE_CACHE.move_to_end(key)
+    if len(_ROUTINE_CACHE) > ROUTINE_CACHE_MAXSIZE:
+        _ROUTINE_CACHE.popitem(last=False)
+
+
+@lru_cache(maxsize=1)
+def _get_cached_config() -> Tuple[Config, Path]:
+    """Config y ruta del prompt, construidos una sola vez (Config() lee JSONs de disco)."""
+    config = Config()
+    return config, config.PROMPTS_DIR / "routine_assembler.txt"
+
+
+def _get_config() -> Tuple[Config, Path]:
+    """Retorna (config, prompt_path); con CONFIG_HOT_RELOAD=1 se relee en cada llamada."""
+    if os.environ.get("CONFIG_HOT_RELOAD"):
+        _get_cached_config.cache_clear()
+    return _get_cached_config()
+
+
+@lru_cache(maxsize=4)
+def _get_chain_components(
+    prompt_file_path: Path,
+) -> Tuple[ChatPromptTemplate, PydanticOutputParser, str]:
+    """
+    Carga el prompt y construye el parser una sola vez por archivo de prompt.
+
+    Returns:
+        (prompt_template, output_parser, format_instructions)
+
+    Raises:
+        FileNotFoundError: Si el archivo de prompt no existe (no se cachea).
+    """
+    logger.info(f"Loading routine assembler prompt from: {prompt_file_path}")
+    # read_bytes lanza FileNotFoundError por sí solo (sin stat previo ni TextIOWrapper)
+    raw_prompt_template = prompt_file_path.read_bytes().decode("utf-8")
+
+    prompt_template = ChatPromptTemplate.from_template(raw_prompt_template)
+    output_parser = PydanticOutputParser(pydantic_object=RutinaActiva)
+    return prompt_template, output_parser, output_parser.get_format_instructions()
+
+
+@lru_cache(maxsize=4)
+def _get_llm(model: str, temperature: float) -> ChatOpenAI:
+    """Cliente ChatOpenAI compartido (reutiliza el cliente HTTP entre llamadas)."""
+    return ChatOpenAI(model=model, temperature=temperature)
+
+
+@lru_cache(maxsize=4)
+def _get_routine_chain(prompt_file_path: Path, model: str) -> RunnableSequence:
+    """
+    Cadena Prompt → LLM → Parser, compuesta una sola vez por (prompt, modelo).
+
+    El LLM responde en JSON mode (`response_format=json_object`): la salida
+    siempre es JSON sintácticamente válido y el parser solo valida el esquema.
+
+    Incluye reintentos (hasta MAX_RETRIES intentos) con backoff exponencial
+    y jitter, solo para errores transitorios (RETRYABLE_ERRORS).
+
+    Raises:
+        FileNotFoundError: Si el archivo de prompt no existe (no se cachea).
+    """
+    prompt_template, output_parser, _ = _get_chain_components(prompt_file_path)
+    # Cadena tradicional: Prompt → LLM → Parser (más estable)
+    llm = _get_llm(model, 0.0).bind(response_format=JSON_RESPONSE_FORMAT)
+    chain = prompt_template | llm | output_parser
+    return chain.with_retry(
+        retry_if_exception_type=RETRYABLE_ERRORS,
+        wait_exponential_jitter=True,
+        exponential_jitter_params=RETRY_JITTER_PARAMS,
+        stop_after_attempt=MAX_RETRIES,
+    )
+
+
 def _validate_generated_routine(rutina: RutinaActiva, principios: PrincipiosExtraidos, perfil: Dict[str, Any]) -> str | None:
-    """Performs deep validation of the generated routine against principles and logistics."""
+    """
+    Performs deep validation of the generated routine against principles and logistics.
+
+    Single pass over sessions/exercises: principle checks, per-session duration
+    and ECI collection happen in the same loop, returning on the first failure.
+    """
     logger.debug("Validating generated routine...")
 
-    if not rutina.sesiones:
+    sesiones = rutina.sesiones
+    if not sesiones:
         return "Rutina generada no tiene sesiones."
 
-    for i, sesion in enumerate(rutina.sesiones):
+    # Hoisted lookups (constant for the whole traversal)
+    required_rir = principios.intensidad_RIR
+    required_tempo = principios.cadencia_tempo
+    preferencias = perfil.get("preferencias_logistica", {})
+    duracion_max_min = preferencias.get("duracion_sesion_min", 60) # Assuming this is max, rename if needed
+    required_eci_names = {eci.nombre_ejercicio for eci in principios.ECI_recomendados}
+    found_eci_names: set[str] = set()
+    add_found_eci = found_eci_names.add
+    total_estimated_duration = 0
+
+    for i, sesion in enumerate(sesiones):
         if not sesion.ejercicios:
             return f"Sesión {i+1} ('{sesion.dia_semana}') no tiene ejercicios."
 
-        for j, ejercicio in enumerate(sesion.ejercicios):
+        for ejercicio in sesion.ejercicios:
+            tipo = ejercicio.tipo
             # Validate against principles (only for 'principal' type for flexibility)
-            if ejercicio.tipo == "principal":
+            if tipo == "principal":
                 
                 # --- INICIO DE VALIDACIÓN DE PRINCIPIOS (Manejo de None) ---
                 # Esta validación ahora debe ser robusta ante un None de RAG
-                if principios.intensidad_RIR is None:
+                if required_rir is None:
                     return f"Principios incompletos: 'intensidad_RIR' es None."
-                if principios.cadencia_tempo is None:
+                if required_tempo is None:
                     return f"Principios incompletos: 'cadencia_tempo' es None."
                 # --- FIN DE VALIDACIÓN DE PRINCIPIOS ---
 
-                if ejercicio.RIR != principios.intensidad_RIR:
+                if ejercicio.RIR != required_rir:
                     return (f"Ejercicio '{ejercicio.nombre}' (Sesión {i+1}) tiene RIR='{ejercicio.RIR}', "
-                            f"pero los principios requieren RIR='{principios.intensidad_RIR}'.")
+                            f"pero los principios requieren RIR='{required_rir}'.")
                 # Add validation for reps range if needed, requires parsing the string range
                 # Example: if not _is_rep_range_compatible(ejercicio.reps, principios.rango_repeticiones): return "Reps inconsistentes"
 
-                if ejercicio.tempo != principios.cadencia_tempo:
+                if ejercicio.tempo != required_tempo:
                     return (f"Ejercicio '{ejercicio.nombre}' (Sesión {i+1}) tiene tempo='{ejercicio.tempo}', "
-                            f"pero los principios requieren tempo='{principios.cadencia_tempo}'.")
-
-    # Validate against logistics (example: duration)
-    preferencias = perfil.get("preferencias_logistica", {})
-    duracion_max_min = preferencias.get("duracion_sesion_min", 60) # Assuming this is max, rename if needed
-
-    # Basic duration estimation (can be refined)
-    total_estimated_duration = sum(s.duracion_estimada_min for s in rutina.sesiones)
-    average_session_duration = total_estimated_duration / len(rutina.sesiones) if rutina.sesiones else 0
-
-    logger.debug(f"Comparing average session duration ({average_session_duration:.1f} min) with max allowed ({duracion_max_min} min)")
-    # Check if *average* exceeds max, or check *each session*
-    for sesion in rutina.sesiones:
-        if sesion.duracion_estimada_min > duracion_max_min:
-            return (f"Sesión '{sesion.dia_semana}' ({sesion.duracion_estimada_min} min) "
+                            f"pero los principios requieren tempo='{required_tempo}'.")
+            elif tipo == "ECI":
+                add_found_eci(ejercicio.nombre)
+
+        # Validate against logistics (example: duration) - each session
+        duracion = sesion.duracion_estimada_min
+        if duracion > duracion_max_min:
+            return (f"Sesión '{sesion.dia_semana}' ({duracion} min) "
                     f"excede la duración máxima permitida ({duracion_max_min} min).")
+        total_estimated_duration += duracion
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            "Average session duration (%.1f min), max allowed (%s min)",
+            total_estimated_duration / len(sesiones), duracion_max_min,
+        )
 
     # Validate inclusion of ECIs
-    required_eci_names = {eci.nombre_ejercicio for eci in principios.ECI_recomendados}
-    found_eci_names = {ej.nombre for s in rutina.sesiones for ej in s.ejercicios if ej.tipo == "ECI"}
     missing_ecis = required_eci_names - found_eci_names
     if missing_ecis:
         return f"Rutina generada omite ECIs obligatorios: {', '.join(missing_ecis)}."
@@ -79,6 +213,145 @@ def _validate_generated_routine(rutina: RutinaActiva, principios: PrincipiosExtr
     logger.debug("Routine validation passed.")
     return None # No errors
 
+class _GenerationRequest(NamedTuple):
+    """Entradas ya preparadas para invocar la cadena de generación."""
+    chain: RunnableSequence
+    prompt_variables: Dict[str, Any]
+    cache_key: str
+    model: str
+    principios: PrincipiosExtraidos
+    perfil: Dict[str, Any]
+
+
+def _prepare_generation(state: GraphState) -> _GenerationRequest | None:
+    """
+    Valida entradas y arma cadena, variables del prompt y clave de caché.
+
+    Returns:
+        _GenerationRequest, o None si falta algo (el error queda en el estado).
+    """
+    principios: PrincipiosExtraidos | None = state.get("principios_libro")
+    perfil_usuario: Dict[str, Any] | None = state.get("perfil_usuario")
+
+    if not principios:
+        logger.error("'principios_libro' missing in state.")
+        state["error"] = "Principios del libro no disponibles para generar rutina."
+        state["step_completed"] = "generate_routine_error"
+        return None
+    if not perfil_usuario:
+        logger.error("'perfil_usuario' missing in state.")
+        state["error"] = "Perfil de usuario no disponible para generar rutina."
+        state["step_completed"] = "generate_routine_error"
+        return None
+
+    # 1-2. Prompt Template, Parser y cadena LCEL (cacheados por prompt y modelo)
+    config, prompt_file_path = _get_config()
+    try:
+        _, _, format_instructions = _get_chain_components(prompt_file_path)
+        chain: RunnableSequence = _get_routine_chain(prompt_file_path, config.LLM_MODEL_ASSEMBLE)
+    except FileNotFoundError:
+        state["error"] = f"Archivo de prompt no encontrado: {prompt_file_path}"
+        state["step_completed"] = "generate_routine_error"
+        return None
+    logger.info("Routine generation chain ready.")
+
+    # 3. Prepare Prompt Variables
+    preferencias_logistica = perfil_usuario.get("preferencias_logistica", {})
+    # Serializador Rust de Pydantic: orden de campos fijo (el del modelo), así que el
+    # texto es idéntico para principios iguales (prefijo estable para el prompt caching)
+    principios_json = principios.model_dump_json()
+    prompt_variables = {
+        "principios": principios_json,
+        "perfil": perfil_usuario,
+        "preferencias": preferencias_logistica,
+        "format_instructions": format_instructions  # ✅ CRÍTICO
+    }
+    logger.debug("Prompt variables prepared: %s", list(prompt_variables))
+
+    cache_key = _routine_cache_key(principios_json, perfil_usuario, config.LLM_MODEL_ASSEMBLE)
+    return _GenerationRequest(
+        chain, prompt_variables, cache_key, config.LLM_MODEL_ASSEMBLE, principios, perfil_usuario
+    )
+
+
+def _set_invocation_error(state: GraphState, e: Exception) -> GraphState:
+    """Traduce el error final de la cadena (tras reintentos) al estado."""
+    if isinstance(e, OutputParserException):
+        logger.error(f"Failed to generate valid routine after {MAX_RETRIES} attempts: {e}")
+        state["error"] = f"LLM no retornó JSON válido después de {MAX_RETRIES} intentos: {e}"
+    else:
+        # API errors, timeouts etc. (transitorios ya reintentados por with_retry)
+        logger.error(f"Routine generation failed: {e}", exc_info=e)
+        if isinstance(e, RETRYABLE_ERRORS):
+            state["error"] = f"Error generando rutina después de {MAX_RETRIES} intentos: {e}"
+        else:
+            state["error"] = f"Error generando rutina: {e}"
+    state["step_completed"] = "generate_routine_error"
+    return state
+
+
+def _complete_generation(
+    state: GraphState,
+    request: _GenerationRequest,
+    generated_routine: RutinaActiva | None,
+    cache_hit: bool,
+    start_time: float,
+) -> GraphState:
+    """Valida la rutina generada y la guarda en el estado (pasos 5-6)."""
+    if not generated_routine:
+        logger.error("Routine generation returned an empty result.")
+        state["error"] = "Error generando rutina: el LLM retornó un resultado vacío."
+        state["step_completed"] = "generate_routine_error"
+        return state
+
+    # debug_info llega como None desde create_initial_state: normalizar una sola vez
+    debug_info = state.get("debug_info")
+    if not isinstance(debug_info, dict):
+        debug_info = state["debug_info"] = {}
+
+    # 5. Validate Generated Routine
+    validation_error = _validate_generated_routine(generated_routine, request.principios, request.perfil)
+    if validation_error:
+        logger.error(f"Generated routine failed validation: {validation_error}")
+        state["error"] = f"Validación fallida: {validation_error}"
+        state["step_completed"] = "generate_routine_error"
+        debug_info["invalid_generated_routine"] = generated_routine.model_dump()
+        return state
+
+    # 6. Success
+    if not cache_hit:
+        _store_cached_routine(request.cache_key, generated_routine)
+    generation_time = time.time() - start_time
+    logger.info(f"Successfully generated and validated routine in {generation_time:.2f} seconds.")
+    state["rutina_final"] = generated_routine
+    state["step_completed"] = "routine_generated" # Corrected step name
+
+
+    # Add metadata
+    metadata = {
+        "tiempo_generacion_segundos": round(generation_time, 2),
+        "modelo_usado": request.model,
+        "temperatura_llm": 0.0,
+        "validation_passed": True,
+        "cache_hit": cache_hit
+    }
+    debug_info["generation_metadata"] = metadata
+    return state
+
+
+def _set_unexpected_error(state: GraphState, e: Exception) -> GraphState:
+    """Errores no previstos durante la generación."""
+    if isinstance(e, FileNotFoundError):
+        logger.error(f"Prompt file error: {e}")
+        state["error"] = "Archivo de prompt de generación no encontrado."
+    else:
+        logger.error(f"An unexpected error occurred during routine generation: {e}", exc_info=e)
+        state["error"] = f"Error inesperado generando rutina: {str(e)}"
+    state["step_completed"] = "generate_routine_error"
+    return state
+
+
+@log_node("Generate Routine")
 def generate_routine(state: GraphState) -> GraphState:
     """
     Nodo: generate_routine
@@ -96,131 +369,94 @@ def generate_routine(state: GraphState) -> GraphState:
     Raises:
       Ninguno (errores van a state["error"]).
     """
-    logger.info("--- Entering Generate Routine Node ---")
     start_time = time.time()
 
-    principios: PrincipiosExtraidos | None = state.get("principios_libro")
-    perfil_usuario: Dict[str, Any] | None = state.get("perfil_usuario")
-
-    if not principios:
-        logger.error("'principios_libro' missing in state.")
-        state["error"] = "Principios del libro no disponibles para generar rutina."
-        state["step_completed"] = "generate_routine_error"
-        return state
-    if not perfil_usuario:
-        logger.error("'perfil_usuario' missing in state.")
-        state["error"] = "Perfil de usuario no disponible para generar rutina."
-        state["step_completed"] = "generate_routine_error"
-        return state
-
     try:
-        config = Config()
-        # 1. Load Prompt Template
-        prompt_file_path = config.PROMPTS_DIR / "routine_assembler.txt"
-        logger.info(f"Loading routine assembler prompt from: {prompt_file_path}")
-        if not prompt_file_path.exists():
-            state["error"] = f"Archivo de prompt no encontrado: {prompt_file_path}"
-            state["step_completed"] = "generate_routine_error"
+        request = _prepare_generation(state)
+        if request is None:
             return state
-        raw_prompt_template = prompt_file_path.read_text(encoding="utf-8")
-
-        # 2. Build LCEL Chain
-        prompt_template = ChatPromptTemplate.from_template(raw_prompt_template)
-        llm = ChatOpenAI(model=config.LLM_MODEL_ASSEMBLE, temperature=0.0)
-        output_parser = PydanticOutputParser(pydantic_object=RutinaActiva)
-
-        # Cadena tradicional: Prompt → LLM → Parser (más estable)
-        chain: RunnableSequence = prompt_template | llm | output_parser
-        logger.info("Routine generation chain built.")
-
-        # 3. Prepare Prompt Variables
-        preferencias_logistica = perfil_usuario.get("preferencias_logistica", {})
-        prompt_variables = {
-            "principios": principios.model_dump(),
-            "perfil": perfil_usuario,
-            "preferencias": preferencias_logistica,
-            "format_instructions": output_parser.get_format_instructions()  # ✅ CRÍTICO
-        }
-        logger.debug(f"Prompt variables prepared: {list(prompt_variables.keys())}")
-
-        # 4. Invoke Chain with Retry Logic
-        generated_routine: RutinaActiva | None = None
-        last_exception = None
-        for attempt in range(MAX_RETRIES):
-            logger.info(f"Attempt {attempt + 1}/{MAX_RETRIES} to generate routine...")
+
+        # 4. Invoke Chain (reintentos en la cadena; salvo hit en la caché de rutinas)
+        generated_routine: RutinaActiva | None = _get_cached_routine(request.cache_key)
+        cache_hit = generated_routine is not None
+        if cache_hit:
+            logger.info("Routine cache hit; skipping LLM invocation.")
+        else:
             try:
-                generated_routine = chain.invoke(prompt_variables)
+                generated_routine = request.chain.invoke(request.prompt_variables)
                 logger.info("LLM invocation successful.")
-                # If successful, break the loop
-                break
-            except OutputParserException as e:
-                logger.warning(f"Attempt {attempt + 1} failed: LLM output did not match Pydantic schema. Error: {e}")
-                last_exception = e
-                time.sleep(1) # Simple backoff
             except Exception as e:
-                # Catch potential API errors, timeouts etc.
-                logger.exception(f"Attempt {attempt + 1} failed with unexpected error: {e}")
-                last_exception = e
-                # Depending on error type, might break early or retry
-                if "timeout" in str(e).lower(): # Example of breaking early on timeout
-                    break
-                time.sleep(1)
-
-        if not generated_routine:
-            logger.error(f"Failed to generate valid routine after {MAX_RETRIES} attempts.")
-            error_detail = str(last_exception) if last_exception else "Unknown error during generation."
-            if isinstance(last_exception, OutputParserException):
-                state["error"] = f"LLM no retornó JSON válido después de {MAX_RETRIES} intentos: {error_detail}"
-            else:
-                state["error"] = f"Error generando rutina después de {MAX_RETRIES} intentos: {error_detail}"
-            state["step_completed"] = "generate_routine_error"
-            return state
+                return _set_invocation_error(state, e)
 
-        # 5. Validate Generated Routine
-        validation_error = _validate_generated_routine(generated_routine, principios, perfil_usuario)
-        if validation_error:
-            logger.error(f"Generated routine failed validation: {validation_error}")
-            state["error"] = f"Validación fallida: {validation_error}"
-            state["step_completed"] = "generate_routine_error"
-            
-            # --- ✅ INICIO DE CORRECCIÓN (Problema 2) ---
-            # Asegurarse de que debug_info exista antes de asignarle una clave
-            if state.get("debug_info") is None:
-                state["debug_info"] = {}
-            # --- FIN DE CORRECCIÓN ---
-            
-            state["debug_info"]["invalid_generated_routine"] = generated_routine.model_dump()
-            return state
+        _complete_generation(state, request, generated_routine, cache_hit, start_time)
 
-        # 6. Success
-        generation_time = time.time() - start_time
-        logger.info(f"Successfully generated and validated routine in {generation_time:.2f} seconds.")
-        state["rutina_final"] = generated_routine
-        state["step_completed"] = "routine_generated" # Corrected step name
-        
-        # Add metadata - Asegurar que debug_info existe
-        # --- ✅ INICIO DE CORRECCIÓN (Problema 2) ---
-        if not isinstance(state.get("debug_info"), dict):
-            state["debug_info"] = {}
-        # --- FIN DE CORRECCIÓN ---
-
-        metadata = {
-            "tiempo_generacion_segundos": round(generation_time, 2),
-            "modelo_usado": config.LLM_MODEL_ASSEMBLE,
-            "temperatura_llm": 0.0,
-            "validation_passed": True
-        }
-        state["debug_info"]["generation_metadata"] = metadata
-
-
-    except FileNotFoundError as e:
-        logger.error(f"Prompt file error: {e}")
-        state["error"] = "Archivo de prompt de generación no encontrado."
-        state["step_completed"] = "generate_routine_error"
     except Exception as e:
-        logger.exception(f"An unexpected error occurred during routine generation: {e}")
-        state["error"] = f"Error inesperado generando rutina: {str(e)}"
-        state["step_completed"] = "generate_routine_error"
+        _set_unexpected_error(state, e)
+
+    return state
+
+
+def generate_routines_batch(states: List[GraphState], max_concurrency: int = 8) -> List[GraphState]:
+    """
+    Variante por lotes de generate_routine para varios usuarios.
 
-    logger.info("--- Exiting Generate Routine Node ---")
-    return state
\ No newline at end of file
+    Los estados con rutina en caché se resuelven sin LLM; el resto se agrupa
+    por clave de caché (entradas idénticas se generan una sola vez) y se
+    invoca con `chain.batch`, en paralelo hasta `max_concurrency` sobre el
+    mismo cliente ChatOpenAI.
+
+    Args:
+      states: Estados con principios_libro y perfil_usuario llenos.
+      max_concurrency: Máximo de invocaciones simultáneas al LLM.
+
+    Returns:
+      List[GraphState]: Los mismos estados, actualizados como lo haría
+      generate_routine, en el mismo orden.
+    """
+    start_time = time.time()
+    requests: List[_GenerationRequest | None] = []
+    pending: Dict[str, List[int]] = {}
+
+    for i, state in enumerate(states):
+        try:
+            request = _prepare_generation(state)
+        except Exception as e:
+            _set_unexpected_error(state, e)
+            request = None
+        requests.append(request)
+        if request is None:
+            continue
+
+        cached = _get_cached_routine(request.cache_key)
+        if cached is not None:
+            _complete_generation(state, request, cached, True, start_time)
+        else:
+            pending.setdefault(request.cache_key, []).append(i)
+
+    if pending:
+        leaders = [requests[indices[0]] for indices in pending.values()]
+        logger.info(f"Generating {len(leaders)} routines in batch (max_concurrency={max_concurrency})...")
+        try:
+            results = leaders[0].chain.batch(
+                [request.prompt_variables for request in leaders],
+                config={"max_concurrency": max_concurrency},
+                return_exceptions=True,
+            )
+        except Exception as e:
+            # return_exceptions solo cubre fallos por entrada; un error del propio
+            # batch (setup, wrapper de reintentos) se reporta en cada estado pendiente
+            for indices in pending.values():
+                for i in indices:
+                    _set_unexpected_error(states[i], e)
+            return states
+
+        for indices, result in zip(pending.values(), results):
+            for n, i in enumerate(indices):
+                if isinstance(result, Exception):
+                    _set_invocation_error(states[i], result)
+                    continue
+                # Cada estado recibe su propia copia de la rutina compartida
+                routine = result if n == 0 or result is None else result.model_copy(deep=True)
+                _complete_generation(states[i], requests[i], routine, False, start_time)
+
+    return states
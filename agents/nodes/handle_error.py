@@ -1,8 +1,9 @@
+import logging
 from typing import Dict, Any, Optional # Import Optional
 
 # Project Imports
 from agents.graph_state import GraphState
-from utils.logger import setup_logger
+from utils.logger import log_node, setup_logger
 
 logger = setup_logger(__name__)
 
@@ -39,6 +40,7 @@ ERROR_MESSAGE_MAP = {
     "no encontrado": "Tu perfil de usuario no se encontró en el sistema.",  # ✅ Genérico para capturar variantes
     "Archivo corrupto": "Hubo un problema al leer los datos de tu perfil. Podría estar corrupto.",
     "Perfil incompleto": "A tu perfil le faltan datos esenciales (como nivel u objetivo).",
+    "Perfil inválido": "Algunos datos de tu perfil tienen un formato inválido (nivel, objetivo o restricciones).",
     "Perfil de usuario no disponible": "No se pudo cargar tu perfil para esta acción.", # Añadido
     
     # ─────────────────────────────────────────────────────────────────────
@@ -65,7 +67,31 @@ ERROR_MESSAGE_MAP = {
 
 DEFAULT_ERROR_MESSAGE = "Ocurrió un error inesperado procesando tu solicitud."
 
+# Keys en minúsculas precalculadas (mismo orden de inserción que ERROR_MESSAGE_MAP)
+_ERROR_ITEMS: tuple[tuple[str, str, str], ...] = tuple(
+    (key.lower(), key, message) for key, message in ERROR_MESSAGE_MAP.items()
+)
 
+def _scan_error_items(technical_error_lower: str) -> tuple[str, str] | None:
+    """Primer (key, message) cuya key aparece en el error (por eso el orden importa)."""
+    for key_lower, key, message in _ERROR_ITEMS:
+        if key_lower in technical_error_lower:
+            return key, message
+    return None
+
+
+# Fast path O(1) para errores cuyo texto es exactamente una key. Se precalcula con el
+# mismo escaneo, así que devuelve lo mismo que el bucle (p.ej. "archivo de prompt no
+# encontrado" sigue resolviendo a la key anterior "no encontrado").
+_EXACT: dict[str, tuple[str, str]] = {
+    key_lower: _scan_error_items(key_lower) for key_lower, _, _ in _ERROR_ITEMS
+}
+
+# Campos grandes que no se vuelcan al log de contexto
+_SKIP = frozenset({"principios_libro", "rutina_final", "perfil_usuario", "debug_info"})
+
+
+@log_node("Handle Error")
 def handle_error(state: GraphState) -> GraphState:
     """
     Nodo: handle_error
@@ -83,7 +109,6 @@ def handle_error(state: GraphState) -> GraphState:
     Raises:
       Ninguno (este nodo es el último recurso y no debe fallar).
     """
-    logger.info("--- Entering Handle Error Node ---")
     # --- CORRECCIÓN --- Asegurar que technical_error_msg sea siempre string
     technical_error_msg: Optional[str] = state.get("error")
     if technical_error_msg is None:
@@ -100,12 +125,10 @@ def handle_error(state: GraphState) -> GraphState:
     # Ahora technical_error_msg es garantizado string (o el default)
     logger.error(f"Error captured in step '{failed_step}': {technical_error_msg}")
 
-    # Log state context (evitando objetos grandes)
-    log_state = {
-        k: v for k, v in state.items()
-        if k not in ['principios_libro', 'rutina_final', 'perfil_usuario']
-    }
-    logger.debug(f"Full state context at error (partial): {log_state}")
+    # Log state context (evitando objetos grandes); solo se construye si DEBUG está activo
+    if logger.isEnabledFor(logging.DEBUG):
+        log_state = {k: v for k, v in state.items() if k not in _SKIP}
+        logger.debug("Full state context at error (partial): %s", log_state)
 
     # ════════════════════════════════════════════════════════════════════
     # 2. MAPEO A MENSAJE USER-FRIENDLY
@@ -113,13 +136,12 @@ def handle_error(state: GraphState) -> GraphState:
     user_friendly_message = DEFAULT_ERROR_MESSAGE
 
     technical_error_lower = technical_error_msg.lower() # Ahora es seguro llamar a .lower()
-    for key, message in ERROR_MESSAGE_MAP.items():
-        if key.lower() in technical_error_lower:
-            user_friendly_message = message
-            logger.debug(f"Mapped error key '{key}' to message: '{message}'")
-            break  # ✅ Usar el primer match (por eso el orden importa)
-    else: # Si el bucle termina sin break
-         logger.debug(f"No specific map found for '{technical_error_msg}'. Using default.")
+    match = _EXACT.get(technical_error_lower) or _scan_error_items(technical_error_lower)
+    if match is not None:
+        key, user_friendly_message = match
+        logger.debug("Mapped error key '%s' to message: '%s'", key, user_friendly_message)
+    else:
+        logger.debug("No specific map found for '%s'. Using default.", technical_error_msg)
 
 
     # ════════════════════════════════════════════════════════════════════
@@ -138,6 +160,5 @@ def handle_error(state: GraphState) -> GraphState:
     state.pop("rutina_final", None)
 
     logger.info(f"Generated user-friendly error message: {state['respuesta_usuario']}")
-    logger.info("--- Exiting Handle Error Node ---")
 
     return state
\ No newline at end of file
@@ -5,20 +5,25 @@
 # antiguas de registro y consulta.
 # -----------------------------------------------------------------------------
 
-from typing import Optional
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
 
 # LangChain and Project Imports
 from agents.graph_state import GraphState
-from utils.logger import setup_logger
+from utils.logger import log_node, setup_logger
 from config.settings import Config
 
 # --- 💡 MODIFICACIÓN: Nuevas importaciones para parseo con LLM 💡 ---
 from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import PydanticOutputParser
 from langchain_core.exceptions import OutputParserException
+from langchain_core.output_parsers import PydanticOutputParser
+from langchain_core.prompts import ChatPromptTemplate
 # ------------------------------------------------------------------
 
+_JSON_RESPONSE_FORMAT = {"type": "json_object"}
+
 
 # Importaciones de herramientas Legacy y su contexto
 # CRÍTICO: Los nodos legacy deben configurar el UserContext
@@ -44,23 +49,51 @@ logger = setup_logger(__name__)
 # -----------------------------------------------------------------------------
 
 
-def _parse_with_llm(user_message: str) -> Optional[EjercicioEstructurado]:
+@lru_cache(maxsize=128)
+def _get_user_context(user_id: str, data_dir: Path) -> "UserContext":
     """
-    Usa un LLM para extraer datos de ejercicio del lenguaje natural.
-    Retorna un objeto EjercicioEstructurado o None si falla.
+    Reutiliza el UserContext de cada usuario (su __init__ hace mkdir del historial).
+    data_dir forma parte de la clave porque UserContext fija sus rutas desde
+    Config.DATA_DIR al construirse.
     """
-    logger.debug(f"Intentando parsear con LLM: '{user_message}'")
+    return UserContext(user_id=user_id)
+
+
+# Fast-path para mensajes estructurados: "[registra|anota|hice] 5x5 de sentadilla con 100kg".
+# Solo cuando no coincide se recurre al LLM. El ejercicio no admite dígitos: cualquier
+# número fuera de la cola "con <n>kg" (p. ej. "curl 15kg") debe ir al LLM, no al nombre.
+# Con el ancla final, texto tras el peso ("con 100kg ayer") tampoco coincide.
+_LEGACY_EXERCISE_PATTERN = re.compile(
+    r"^\s*(?:(?:registra|anota|hice)\s+)?"
+    r"(?P<series>\d+)\s*[x×]\s*(?P<repeticiones>\d+)\s+"
+    r"(?:de\s+)?(?P<ejercicio>[^\d]+?)"
+    r"(?:\s+con\s+(?P<peso_kg>\d+(?:[.,]\d+)?)\s*(?:kg|kilos?)?)?\s*$",
+    re.IGNORECASE,
+)
 
-    # 1. Definir el parser Pydantic
-    parser = PydanticOutputParser(pydantic_object=EjercicioEstructurado)
 
-    # 2. Definir el Prompt
-    prompt_template = """
+def _parse_legacy_exercise(user_message: str) -> Optional[Dict[str, Any]]:
+    """
+    Parsea con regex el formato "NxM de <ejercicio> con <peso>kg".
+    Retorna los 4 campos de EjercicioEstructurado o None si no coincide.
+    """
+    match = _LEGACY_EXERCISE_PATTERN.match(user_message)
+    if not match:
+        return None
+    peso = match.group("peso_kg")
+    return {
+        "ejercicio": match.group("ejercicio").strip().lower(),
+        "series": int(match.group("series")),
+        "repeticiones": int(match.group("repeticiones")),
+        "peso_kg": float(peso.replace(",", ".")) if peso else 0.0,
+    }
+
+
+# Parte estática (rol, campos, ejemplos, formato) como mensaje de sistema y el texto
+# del usuario al final: prefijo idéntico entre llamadas para el prompt caching de OpenAI.
+_PARSE_SYSTEM_PROMPT = """
     Eres un asistente que extrae información de ejercicios de un texto en lenguaje natural.
-    Analiza el siguiente texto del usuario y extrae SOLAMENTE los 4 campos requeridos.
-    
-    Texto del usuario:
-    "{user_message}"
+    Analiza el texto del usuario y extrae SOLAMENTE los 4 campos requeridos.
     
     Campos a extraer:
     - ejercicio: str (ej. "sentadilla", "press de banca")
@@ -83,24 +116,55 @@ def _parse_with_llm(user_message: str) -> Optional[EjercicioEstructurado]:
     Formato de salida (SOLO JSON):
     {format_instructions}
     """
-    
-    prompt = ChatPromptTemplate.from_template(
-        template=prompt_template,
-        partial_variables={"format_instructions": parser.get_format_instructions()}
-    )
+_PARSE_USER_PROMPT = 'Texto del usuario:\n"{user_message}"'
+
+
+@lru_cache(maxsize=1)
+def _get_parse_chain():
+    """
+    Construye una sola vez la cadena prompt | llm | parser de extracción.
+    Si ChatOpenAI no se puede inicializar, la excepción se propaga y no se cachea.
+    """
+    parser = PydanticOutputParser(pydantic_object=EjercicioEstructurado)
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", _PARSE_SYSTEM_PROMPT), ("user", _PARSE_USER_PROMPT)]
+    ).partial(format_instructions=parser.get_format_instructions())
+    llm = ChatOpenAI(model=Config.LLM_MODEL_PARSE, temperature=0.0)
+    # Modo JSON nativo: el modelo siempre emite un objeto JSON parseable
+    return prompt | llm.bind(response_format=_JSON_RESPONSE_FORMAT) | parser
+
+
+@lru_cache(maxsize=1024)
+def _cached_llm_parse(user_message: str) -> Tuple[str, int, int, float]:
+    """
+    Memo en proceso por mensaje exacto: repetir un registro no vuelve a invocar
+    la cadena. Retorna una tupla (hashable, inmutable) con los 4 campos; si la
+    cadena falla la excepción se propaga y el fallo no queda cacheado.
+    Es la única caché del parseo: el LLM no lleva cache=, que ante un fallo
+    devolvería la misma generación inválida y el reintento nunca tendría éxito.
+    """
+    parsed = _get_parse_chain().invoke({"user_message": user_message})
+    return (parsed.ejercicio, parsed.series, parsed.repeticiones, parsed.peso_kg)
+
+
+def _parse_with_llm(user_message: str) -> Optional[EjercicioEstructurado]:
+    """
+    Usa un LLM para extraer datos de ejercicio del lenguaje natural.
+    Retorna un objeto EjercicioEstructurado o None si falla.
+    """
+    logger.debug(f"Intentando parsear con LLM: '{user_message}'")
 
-    # 3. Definir el LLM (usando el modelo de extracción de la config)
     try:
-        llm = ChatOpenAI(model=Config.LLM_MODEL_EXTRACT, temperature=0.0)
+        _get_parse_chain()
     except Exception as e:
         logger.error(f"No se pudo inicializar ChatOpenAI (¿API key?): {e}")
         return None
 
-    # 4. Crear y ejecutar la cadena
-    chain = prompt | llm | parser
-
     try:
-        parsed_data = chain.invoke({"user_message": user_message})
+        ejercicio, series, repeticiones, peso_kg = _cached_llm_parse(user_message)
+        parsed_data = EjercicioEstructurado(
+            ejercicio=ejercicio, series=series, repeticiones=repeticiones, peso_kg=peso_kg
+        )
         logger.info(f"LLM parseó exitosamente: {parsed_data}")
         return parsed_data
     except OutputParserException as e:
@@ -111,20 +175,21 @@ def _parse_with_llm(user_message: str) -> Optional[EjercicioEstructurado]:
         return None
 
 
+@log_node("Legacy Register")
 def call_legacy_register(state: GraphState) -> GraphState:
     """
     Nodo: call_legacy_register
 
     Wrapper para la herramienta legacy 'registrar_ejercicio'.
-    Usa un LLM para parsear el user_message.
+    Si el estado trae ejercicio_data ya estructurado lo usa tal cual; si no,
+    parsea el user_message con regex y, si no coincide, con un LLM.
 
     Args:
-      state (GraphState): Estado con user_id y user_message.
+      state (GraphState): Estado con user_id y user_message (o ejercicio_data).
 
     Returns:
       GraphState: Estado actualizado con respuesta_usuario o error.
     """
-    logger.info("--- Entering Legacy Register Node ---")
     user_id = state.get("user_id")
     user_message = state.get("user_message", "")
 
@@ -140,9 +205,18 @@ def call_legacy_register(state: GraphState) -> GraphState:
         return state
 
     try:
-        # --- 💡 MODIFICACIÓN: Llamar al parser LLM 💡 ---
-        logger.info(f"Iniciando parseo con LLM para: '{user_message}'")
-        ejercicio_data = _parse_with_llm(user_message)
+        # 1. Parseo: datos ya estructurados > regex > LLM (solo si el formato no es reconocido)
+        ejercicio_data = state.get("ejercicio_data")
+        if isinstance(ejercicio_data, dict):
+            ejercicio_data = EjercicioEstructurado.model_validate(ejercicio_data)
+        if isinstance(ejercicio_data, EjercicioEstructurado):
+            logger.info("Usando ejercicio_data ya estructurado del estado (sin parseo)")
+        elif (parsed := _parse_legacy_exercise(user_message)) is not None:
+            logger.info(f"Mensaje parseado por regex (sin LLM): {parsed}")
+            ejercicio_data = EjercicioEstructurado.model_validate(parsed)
+        else:
+            logger.info(f"Iniciando parseo con LLM para: '{user_message}'")
+            ejercicio_data = _parse_with_llm(user_message)
 
         if not ejercicio_data:
             logger.warning(f"El LLM no pudo parsear el mensaje: {user_message}")
@@ -153,8 +227,7 @@ def call_legacy_register(state: GraphState) -> GraphState:
 
         # 2. Configurar el contexto legacy
         logger.debug(f"Configurando UserContext legacy para: {user_id}")
-        context = UserContext(user_id=user_id)
-        set_user_context(context)
+        set_user_context(_get_user_context(user_id, Config.DATA_DIR))
 
         # 3. Preparar datos y llamar a la herramienta usando .invoke()
         # 'ejercicio_data' YA ES un objeto EjercicioEstructurado
@@ -171,7 +244,6 @@ def call_legacy_register(state: GraphState) -> GraphState:
         state["error"] = f"Error interno al registrar ejercicio: {str(e)}"
         state["step_completed"] = "call_legacy_register_error"
 
-    logger.info("--- Exiting Legacy Register Node ---")
     return state
 
 
@@ -179,6 +251,7 @@ def call_legacy_register(state: GraphState) -> GraphState:
 # NODO: CALL LEGACY QUERY
 # -----------------------------------------------------------------------------
 
+@log_node("Legacy Query")
 def call_legacy_query(state: GraphState) -> GraphState:
     """
     Nodo: call_legacy_query
@@ -192,7 +265,6 @@ def call_legacy_query(state: GraphState) -> GraphState:
     Returns:
       GraphState: Estado actualizado con respuesta_usuario o error.
     """
-    logger.info("--- Entering Legacy Query Node ---")
     user_id = state.get("user_id")
 
     if not user_id:
@@ -209,8 +281,7 @@ def call_legacy_query(state: GraphState) -> GraphState:
     try:
         # 1. Configurar el contexto legacy
         logger.debug(f"Configurando UserContext legacy para: {user_id}")
-        context = UserContext(user_id=user_id)
-        set_user_context(context)
+        set_user_context(_get_user_context(user_id, Config.DATA_DIR))
 
         # 2. Llamar a la herramienta usando .invoke()
         logger.info(f"Invocando herramienta legacy consultar_historial para {user_id}")
@@ -227,5 +298,4 @@ def call_legacy_query(state: GraphState) -> GraphState:
         state["error"] = f"Error interno al consultar historial: {str(e)}"
         state["step_completed"] = "call_legacy_query_error"
 
-    logger.info("--- Exiting Legacy Query Node ---")
     return state
\ No newline at end of file
@@ -1,12 +1,23 @@
-import json
-
 # Project Imports
 from agents.graph_state import GraphState
 from config.settings import Config
-from utils.logger import setup_logger
+from utils.helpers import json_loads
+from utils.logger import log_node, setup_logger
 
 logger = setup_logger(__name__)
 
+VALID_REQUEST_TYPES = frozenset({"crear_rutina", "registrar_ejercicio", "consultar_historial"})
+REQUIRED_PROFILE_FIELDS = ("level", "objetivo")  # tupla: conserva el orden en el mensaje de error
+
+
+def _set_error(state: GraphState, message: str) -> GraphState:
+    """Registra el error del nodo en el estado."""
+    state["error"] = message
+    state["step_completed"] = "load_context_error"
+    return state
+
+
+@log_node("Load Context")
 def load_context(state: GraphState) -> GraphState:
     """
     Nodo: load_context
@@ -25,34 +36,23 @@ def load_context(state: GraphState) -> GraphState:
     Raises:
       Ninguno (errores van a state["error"])
     """
-    logger.info("--- Entering Load Context Node ---")
-    
     # ════════════════════════════════════════════════════════════════════
     # VALIDACIÓN 1: REQUEST_TYPE (NUEVO - Movido desde router)
     # ════════════════════════════════════════════════════════════════════
     request_type = state.get("request_type", "unknown")
-    VALID_REQUEST_TYPES = ["crear_rutina", "registrar_ejercicio", "consultar_historial"]
-    
     if request_type not in VALID_REQUEST_TYPES:
-        logger.error(f"Request type inválido: '{request_type}'. Válidos: {VALID_REQUEST_TYPES}")
-        state["error"] = f"Tipo de request desconocido: {request_type}"
-        state["step_completed"] = "load_context_error"
-        logger.info("--- Exiting Load Context Node (request_type inválido) ---")
-        return state
-    
-    logger.debug(f"Request type válido: '{request_type}'")
-    
+        logger.error(f"Request type inválido: '{request_type}'. Válidos: {sorted(VALID_REQUEST_TYPES)}")
+        return _set_error(state, f"Tipo de request desconocido: {request_type}")
+
+    logger.debug("Request type válido: '%s'", request_type)
+
     # ════════════════════════════════════════════════════════════════════
     # VALIDACIÓN 2: USER_ID
     # ════════════════════════════════════════════════════════════════════
     user_id = state.get("user_id")
-
     if not user_id:
         logger.error("User ID missing in state.")
-        state["error"] = "User ID es requerido en el estado inicial."
-        state["step_completed"] = "load_context_error"
-        logger.info("--- Exiting Load Context Node (user_id ausente) ---")
-        return state
+        return _set_error(state, "User ID es requerido en el estado inicial.")
 
     # ════════════════════════════════════════════════════════════════════
     # CARGA DE PERFIL DESDE JSON
@@ -61,52 +61,39 @@ def load_context(state: GraphState) -> GraphState:
         user_file_path = Config.USERS_DIR / f"{user_id}.json"
         logger.info(f"Attempting to load user profile from: {user_file_path}")
 
-        # Validar existencia del archivo
-        if not user_file_path.exists():
-            logger.error(f"User file not found for user_id: {user_id} at {user_file_path}")
-            state["error"] = f"Usuario '{user_id}' no encontrado en {Config.USERS_DIR}"
-            state["step_completed"] = "load_context_error"
-            logger.info("--- Exiting Load Context Node (archivo no encontrado) ---")
-            return state
-
-        # Cargar JSON
-        with open(user_file_path, "r", encoding="utf-8") as f:
-            user_profile = json.load(f)
-
-        # ════════════════════════════════════════════════════════════════
-        # VALIDACIÓN 3: CAMPOS REQUERIDOS EN PERFIL
-        # ════════════════════════════════════════════════════════════════
-        required_fields = ["level", "objetivo"]
-        missing_fields = [field for field in required_fields if field not in user_profile]
-
-        if missing_fields:
-            logger.error(f"User profile for {user_id} is incomplete. Missing fields: {missing_fields}")
-            state["error"] = f"Perfil incompleto: falta {', '.join(missing_fields)}"
-            state["step_completed"] = "load_context_error"
-            logger.info("--- Exiting Load Context Node (perfil incompleto) ---")
-            return state
-
-        # ════════════════════════════════════════════════════════════════
-        # ÉXITO: POBLAR ESTADO
-        # ════════════════════════════════════════════════════════════════
-        state["perfil_usuario"] = user_profile
-        state["step_completed"] = "context_loaded"
-        logger.info(f"Successfully loaded profile for user: {user_id}")
-        logger.debug(f"Profile summary: level={user_profile.get('level')}, objetivo={user_profile.get('objetivo')}")
-
-    except json.JSONDecodeError as e:
+        # Cargar JSON. Sin exists() previo: read_bytes ya lanza FileNotFoundError
+        # si el usuario no existe. Sin caché: releer y parsear es más barato que
+        # stat + deepcopy de una entrada cacheada.
+        user_profile = json_loads(user_file_path.read_bytes())
+
+    except FileNotFoundError:
+        logger.error(f"User file not found for user_id: {user_id} at {user_file_path}")
+        return _set_error(state, f"Usuario '{user_id}' no encontrado en {Config.USERS_DIR}")
+
+    except ValueError as e:  # json.JSONDecodeError / orjson.JSONDecodeError
         logger.exception(f"Failed to decode JSON for user {user_id}: {e}")
-        state["error"] = f"Archivo corrupto para usuario '{user_id}': {str(e)}"
-        state["step_completed"] = "load_context_error"
-        logger.info("--- Exiting Load Context Node (JSON corrupto) ---")
-        return state
-        
+        return _set_error(state, f"Archivo corrupto para usuario '{user_id}': {str(e)}")
+
     except Exception as e:
         logger.exception(f"An unexpected error occurred loading context for user {user_id}: {e}")
-        state["error"] = f"Error inesperado cargando perfil de '{user_id}': {str(e)}"
-        state["step_completed"] = "load_context_error"
-        logger.info("--- Exiting Load Context Node (error inesperado) ---")
-        return state
+        return _set_error(state, f"Error inesperado cargando perfil de '{user_id}': {str(e)}")
 
-    logger.info("--- Exiting Load Context Node ---")
-    return state
\ No newline at end of file
+    # ════════════════════════════════════════════════════════════════════
+    # VALIDACIÓN 3: CAMPOS REQUERIDOS EN PERFIL
+    # ════════════════════════════════════════════════════════════════════
+    missing_fields = [field for field in REQUIRED_PROFILE_FIELDS if field not in user_profile]
+    if missing_fields:
+        logger.error(f"User profile for {user_id} is incomplete. Missing fields: {missing_fields}")
+        return _set_error(state, f"Perfil incompleto: falta {', '.join(missing_fields)}")
+
+    # ════════════════════════════════════════════════════════════════════
+    # ÉXITO: POBLAR ESTADO
+    # ════════════════════════════════════════════════════════════════════
+    state["perfil_usuario"] = user_profile
+    state["step_completed"] = "context_loaded"
+    logger.info(f"Successfully loaded profile for user: {user_id}")
+    logger.debug(
+        "Profile summary: level=%s, objetivo=%s",
+        user_profile.get("level"), user_profile.get("objetivo"),
+    )
+    return state
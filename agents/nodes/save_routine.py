@@ -1,5 +1,7 @@
-import json
+import os
+import re
 import shutil
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 from typing import Dict, Any
@@ -8,10 +10,59 @@ from typing import Dict, Any
 from agents.graph_state import GraphState
 from rag.models import RutinaActiva
 from config.settings import Config
-from utils.logger import setup_logger
+from utils.helpers import atomic_write, json_dumps_pretty, json_loads
+from utils.logger import log_node, setup_logger
 
 logger = setup_logger(__name__)
 
+BACKUPS_TO_KEEP = 5
+# Un solo worker: las podas se serializan y nunca compiten entre sí
+_PRUNE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="backup-prune")
+
+
+def _create_backup(src: Path, dst: Path) -> None:
+    """
+    Backup sin copiar bytes: hardlink al mismo inodo. Si el FS no admite hardlinks
+    (o dst ya existe), se copia.
+
+    INVARIANTE: los archivos de data/users/ solo se sustituyen con os.replace
+    (utils.helpers.atomic_write, nuevo inodo); nunca se reescriben en sitio
+    (open("w"), write_bytes...). Una escritura en sitio truncaría el inodo
+    compartido y el backup cambiaría junto con el archivo.
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy(str(src), str(dst))
+
+
+def _prune_backups(user_file_path: Path, keep: int = BACKUPS_TO_KEEP) -> int:
+    """
+    Conserva solo los `keep` backups más recientes de un usuario y borra el resto.
+    El orden sale del nombre (<stem>.<YYYYmmddHHMMSS>.backup): el mtime no sirve
+    porque el backup es un hardlink y hereda el del archivo respaldado.
+    Retorna cuántos backups se eliminaron.
+    """
+    # Nombre exacto: un prefijo "<stem>." también capturaría a "<stem>.otro.<ts>.backup"
+    # (p. ej. "ana" vs "ana.perez") y borraría backups de otro usuario.
+    pattern = re.compile(rf"{re.escape(user_file_path.stem)}\.\d{{14}}\.backup")
+    with os.scandir(user_file_path.parent) as it:
+        backups = sorted(
+            (e for e in it if pattern.fullmatch(e.name)),
+            key=lambda e: e.name,
+            reverse=True,
+        )
+    removed = 0
+    for entry in backups[keep:]:
+        try:
+            os.unlink(entry.path)
+            removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove old backup {entry.path}: {e}")
+    return removed
+
+
+@log_node("Save Routine")
 def save_routine(state: GraphState) -> GraphState:
     """
     Nodo: save_routine
@@ -28,7 +79,6 @@ def save_routine(state: GraphState) -> GraphState:
     Raises:
       Ninguno (errores van a state["error"]).
     """
-    logger.info("--- Entering Save Routine Node ---")
     user_id = state.get("user_id")
     rutina_final: RutinaActiva | None = state.get("rutina_final")
 
@@ -43,69 +93,56 @@ def save_routine(state: GraphState) -> GraphState:
         state["step_completed"] = "save_routine_error"
         return state
 
-    backup_path = None
-    original_content = None
     user_file_path = Config.USERS_DIR / f"{user_id}.json"
 
     try:
         logger.info(f"Attempting to save routine for user {user_id} to {user_file_path}")
 
-        if not user_file_path.exists():
-            # This should ideally be caught by load_context, but double-check
-            logger.error(f"User file {user_file_path} not found. Cannot save routine.")
-            state["error"] = f"Archivo de usuario no encontrado en {user_file_path}"
-            state["step_completed"] = "save_routine_error"
-            return state
-
         # --- Transaction Start ---
-        # 1. Read current content
-        with open(user_file_path, "r", encoding="utf-8") as f:
-            original_content = f.read()
-            user_data = json.loads(original_content)
+        # 1. Read current content (sin exists() previo: si falta, salta FileNotFoundError)
+        user_data = json_loads(user_file_path.read_bytes())
 
         # 2. Create backup
-        timestamp_backup = datetime.now().strftime("%Y%m%d%H%M%S")
+        # Un único instante para el nombre del backup y updated_at (coinciden en auditoría)
+        now = datetime.now()
+        timestamp_backup = now.strftime("%Y%m%d%H%M%S")
         backup_path = user_file_path.parent / f"{user_file_path.stem}.{timestamp_backup}.backup"
-        shutil.copy(str(user_file_path), str(backup_path))
+        _create_backup(user_file_path, backup_path)
         logger.info(f"Created backup at: {backup_path}")
 
         # 3. Update data
-        user_data["rutina_activa"] = rutina_final.model_dump(mode='json')
-        user_data["updated_at"] = datetime.now().isoformat()
+        # mode="json": tipos JSON nativos para que json_dumps_pretty indente toda la
+        # rutina igual con orjson o con json estándar (mismo archivo en cualquier entorno)
+        user_data["rutina_activa"] = rutina_final.model_dump(mode="json")
+        user_data["updated_at"] = now.isoformat()
         logger.debug("User data updated with new routine.")
 
-        # 4. Write updated data back to original file
-        with open(user_file_path, "w", encoding="utf-8") as f:
-            json.dump(user_data, f, indent=2, ensure_ascii=False)
+        # 4. Write to temp + os.replace (nuevo inodo: el backup hardlinkeado queda intacto).
+        # fsync: durable antes de confirmar; releer lo escrito no detecta nada (page cache)
+        with atomic_write(user_file_path) as f:
+            f.write(json_dumps_pretty(user_data))
         logger.info(f"Successfully wrote updated data to {user_file_path}")
-
-        # 5. Verification (Optional but recommended)
-        with open(user_file_path, "r", encoding="utf-8") as f:
-            written_data = json.load(f)
-        if written_data.get("rutina_activa", {}).get("fecha_creacion") != rutina_final.fecha_creacion:
-            raise IOError("Verification failed: Written data does not match expected routine.")
-        logger.info("Post-write verification passed.")
         # --- Transaction End ---
 
+        # Poda de backups antiguos fuera del camino crítico
+        _PRUNE_EXECUTOR.submit(_prune_backups, user_file_path)
+
         # Success
         state["respuesta_usuario"] = "✅ Rutina guardada exitosamente en tu perfil."
         state["step_completed"] = "saved"
 
+    # Sin restauración: el original solo se sustituye con os.replace (atómico) y
+    # atomic_write ya descarta el temporal, así que ante cualquier error sigue intacto.
+    except FileNotFoundError:
+        # This should ideally be caught by load_context, but double-check
+        logger.error(f"User file {user_file_path} not found. Cannot save routine.")
+        state["error"] = f"Archivo de usuario no encontrado en {user_file_path}"
+        state["step_completed"] = "save_routine_error"
     except (IOError, OSError, shutil.Error) as e:
         logger.exception(f"File system error saving routine for {user_id}: {e}")
         state["error"] = f"Error de archivo guardando rutina: {str(e)}"
         state["step_completed"] = "save_routine_error"
-        # Attempt to restore from backup
-        if backup_path and backup_path.exists() and original_content:
-            try:
-                logger.warning(f"Attempting to restore original file {user_file_path} from backup {backup_path}")
-                with open(user_file_path, "w", encoding="utf-8") as f_restore:
-                    f_restore.write(original_content)
-                logger.info("Restored original file content.")
-            except Exception as restore_e:
-                logger.error(f"CRITICAL: Failed to restore from backup after save error: {restore_e}")
-                state["error"] += f" | ADVERTENCIA: No se pudo restaurar el backup: {restore_e}"
-    except json.JSONDecodeError as e:
+    except ValueError as e:  # JSON inválido (json / orjson JSONDecodeError)
         logger.exception(f"Error decoding existing JSON for user {user_id}: {e}")
         state["error"] = f"Archivo de usuario existente está corrupto: {str(e)}"
         state["step_completed"] = "save_routine_error"
@@ -113,16 +150,5 @@ def save_routine(state: GraphState) -> GraphState:
         logger.exception(f"An unexpected error occurred saving routine for user {user_id}: {e}")
         state["error"] = f"Error inesperado guardando rutina: {str(e)}"
         state["step_completed"] = "save_routine_error"
-        # Attempt restore here too if backup was created before unexpected error
-        if backup_path and backup_path.exists() and original_content:
-            try:
-                logger.warning(f"Attempting restore due to unexpected error...")
-                with open(user_file_path, "w", encoding="utf-8") as f_restore:
-                    f_restore.write(original_content)
-                logger.info("Restored original file content.")
-            except Exception as restore_e:
-                logger.error(f"CRITICAL: Failed to restore from backup: {restore_e}")
-                state["error"] += f" | ADVERTENCIA: No se pudo restaurar: {restore_e}"
-
-    logger.info("--- Exiting Save Routine Node ---")
+
     return state
\ No newline at end of file
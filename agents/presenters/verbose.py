@@ -2,8 +2,13 @@
 Presenter inteligente para modo verbose.
 Solo imprime eventos NUEVOS en cada step (no repite).
 """
+from collections import deque
+from typing import Deque, Dict, Any, Set
+
 from .base import Presenter
-from typing import Dict, Any, Set, Tuple
+
+# Máximo de eventos recordados para deduplicar (sesiones largas no crecen sin límite)
+MAX_TRACKED_EVENTS = 10_000
 
 
 class VerbosePresenter(Presenter):
@@ -13,11 +18,23 @@ class VerbosePresenter(Presenter):
     
     def __init__(self):
         self.step_counter = 0
-        self.printed_events: Set[Tuple[str, str]] = set()  # Evita duplicados
+        self.printed_events: Set[int] = set()  # Evita duplicados (hashes de eventos)
+        self._event_order: Deque[int] = deque()  # Orden de inserción para desalojar los más viejos
     
-    def _create_event_id(self, event_type: str, content: str) -> Tuple[str, str]:
-        """Crea un ID único para un evento"""
-        return (event_type, content[:50])  # Primeros 50 chars como identificador
+    def _create_event_id(self, event_type: str, content: str) -> int:
+        """Crea un ID (hash entero de 64 bits) para un evento"""
+        return hash((event_type, content[:50]))  # Primeros 50 chars como identificador
+    
+    def _is_new_event(self, event_type: str, content: str) -> bool:
+        """Registra el evento y retorna True si no se había impreso antes."""
+        event_id = self._create_event_id(event_type, content)
+        if event_id in self.printed_events:
+            return False
+        if len(self._event_order) >= MAX_TRACKED_EVENTS:
+            self.printed_events.discard(self._event_order.popleft())
+        self.printed_events.add(event_id)
+        self._event_order.append(event_id)
+        return True
     
     def print_user_context(self, context: Dict[str, str]) -> None:
         """Imprime el contexto del usuario"""
@@ -34,10 +51,7 @@ class VerbosePresenter(Presenter):
         
         INTELIGENTE: Solo imprime si es pensamiento nuevo
         """
-        event_id = self._create_event_id("thinking", content)
-        
-        if event_id not in self.printed_events:
-            self.printed_events.add(event_id)
+        if self._is_new_event("thinking", content):
             print(f"\n📍 [Step {step}]")
             print(f"  💭 Pensamiento: {content}")
     
@@ -48,10 +62,7 @@ class VerbosePresenter(Presenter):
         INTELIGENTE: Solo imprime si es una llamada nueva
         """
         input_str = str(tool_input)
-        event_id = self._create_event_id("tool_call", tool_name + input_str)
-        
-        if event_id not in self.printed_events:
-            self.printed_events.add(event_id)
+        if self._is_new_event("tool_call", tool_name + input_str):
             print(f"  🔧 Llamando herramienta: {tool_name}")
             print(f"     Parámetros: {tool_input}")
     
@@ -61,10 +72,7 @@ class VerbosePresenter(Presenter):
         
         INTELIGENTE: Solo imprime si es resultado nuevo
         """
-        event_id = self._create_event_id("tool_result", tool_name + result[:30])
-        
-        if event_id not in self.printed_events:
-            self.printed_events.add(event_id)
+        if self._is_new_event("tool_result", tool_name + result[:30]):
             print(f"  ✅ Resultado [{tool_name}]:")
             # Limitar líneas largas
             lines = result.split('\n')
@@ -75,10 +83,7 @@ class VerbosePresenter(Presenter):
     
     def print_user_message(self, message: str) -> None:
         """Imprime mensaje del usuario (solo una vez)"""
-        event_id = self._create_event_id("user_msg", message)
-        
-        if event_id not in self.printed_events:
-            self.printed_events.add(event_id)
+        if self._is_new_event("user_msg", message):
             print(f"  👤 User: {message}")
     
     def print_final_response(self, response: str) -> None:
@@ -93,4 +98,5 @@ class VerbosePresenter(Presenter):
     def reset(self) -> None:
         """Reseta el contador de eventos (para nueva conversación)"""
         self.printed_events.clear()
+        self._event_order.clear()
         self.step_counter = 0
\ No newline at end of file
@@ -8,9 +8,16 @@ El nuevo sistema RAG (Fase 2+) carga prompts directamente desde archivos .txt:
 
 NO modificar este archivo a menos que sea necesario para el agente legacy.
 """
+from functools import lru_cache
 from pathlib import Path
 from datetime import datetime
 
+
+@lru_cache(maxsize=None)
+def _read_prompt(file_path: Path) -> str:
+    """Lee (una sola vez por proceso) el contenido de un archivo de prompt."""
+    return file_path.read_bytes().decode("utf-8")
+
 class PromptLoader:
     """Carga y formatea prompts desde archivos .txt"""
     
@@ -19,9 +26,7 @@ class PromptLoader:
     
     def _load_prompt(self, filename: str) -> str:
         """Carga un archivo de prompt"""
-        file_path = self.prompts_dir / filename
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        return _read_prompt(self.prompts_dir / filename)
     
     def get_adaptive_prompt(self, config) -> str:
         """Genera prompt adaptado desde config (que tiene datos del JSON)"""
@@ -38,14 +43,14 @@ class PromptLoader:
         fecha = datetime.now().strftime("%Y-%m-%d %H:%M")
         
         # Formatear con datos del JSON
-        return template.format(
-            user_name=config.USER_NAME,
-            nivel=config.USER_LEVEL,
-            workout_count=config.WORKOUT_COUNT,
-            fecha=fecha,
-            motivacion=motivacion,
-            objetivo=config.OBJETIVO,
-            frecuencia=config.FRECUENCIA,
-            ejercicios_fav=", ".join(config.EJERCICIOS_FAV),
-            restricciones=", ".join(config.RESTRICCIONES) if config.RESTRICCIONES else "Ninguna"
-        )
+        return template.format_map({
+            "user_name": config.USER_NAME,
+            "nivel": config.USER_LEVEL,
+            "workout_count": config.WORKOUT_COUNT,
+            "fecha": fecha,
+            "motivacion": motivacion,
+            "objetivo": config.OBJETIVO,
+            "frecuencia": config.FRECUENCIA,
+            "ejercicios_fav": ", ".join(config.EJERCICIOS_FAV),
+            "restricciones": ", ".join(config.RESTRICCIONES) if config.RESTRICCIONES else "Ninguna",
+        })
@@ -2,10 +2,11 @@
 Configuración con carga desde JSONs
 """
 import os
-import json
 from pathlib import Path
 from dotenv import load_dotenv
 
+from utils.helpers import atomic_write, json_dumps_pretty, json_loads
+
 load_dotenv()
 
 class Config:
@@ -38,8 +39,7 @@ class Config:
         if not settings_path.exists():
             self._create_default_app_settings(settings_path)
         
-        with open(settings_path, "r", encoding="utf-8") as f:
-            self.app_settings = json.load(f)
+        self.app_settings = json_loads(settings_path.read_bytes())
         
         # LLM config
         llm = self.app_settings["llm"]
@@ -77,8 +77,7 @@ class Config:
             print(f"⚠️  Usuario '{self.user_id}' no encontrado, usando default")
             user_file = Config.USERS_DIR / "default.json"
         
-        with open(user_file, "r", encoding="utf-8") as f:
-            self.user_data = json.load(f)
+        self.user_data = json_loads(user_file.read_bytes())
         
         # Extraer datos del usuario
         self.USER_ID = self.user_data["user_id"]
@@ -113,8 +112,7 @@ class Config:
             "default_user_id": "default"
         }
         
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(default_settings, f, indent=2, ensure_ascii=False)
+        path.write_bytes(json_dumps_pretty(default_settings))
         
         print(f"✅ Creado: {path}")
     
@@ -132,8 +130,10 @@ class Config:
             "restricciones": self.RESTRICCIONES
         })
         
-        with open(user_file, "w", encoding="utf-8") as f:
-            json.dump(self.user_data, f, indent=2, ensure_ascii=False)
+        # Nunca escribir en sitio: save_routine guarda backups como hardlinks del
+        # archivo del usuario y un write_bytes los modificaría también.
+        with atomic_write(user_file) as f:
+            f.write(json_dumps_pretty(self.user_data))
         
         print(f"💾 Usuario guardado: {user_file}")
     
@@ -152,5 +152,7 @@ class Config:
 
     # LLM Models (Phase 0 Migration)
     LLM_MODEL_EXTRACT = "gpt-4o-mini"
+    # Parseo de registros legacy (4 campos): tarea simple, admite el modelo más barato
+    LLM_MODEL_PARSE = "gpt-4o-mini"
     LLM_MODEL_ASSEMBLE = "gpt-4o-mini"
     LLM_TEMPERATURE = 0.0
\ No newline at end of file
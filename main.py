@@ -4,20 +4,14 @@
 # determina el tipo de request, invoca el grafo y muestra la respuesta.
 # -----------------------------------------------------------------------------
 
+import re
 import sys
 from datetime import datetime
 
-# Importar el grafo compilado de Fase 5
-try:
-    from agents.entrenador import graph
-except ImportError as e:
-    print(f"Error: No se pudo importar el grafo. ¿Están todos los nodos definidos? {e}", file=sys.stderr)
-    sys.exit(1)
-except Exception as e:
-    print(f"Error compilando el grafo: {e}", file=sys.stderr)
-    sys.exit(1)
-
 # Imports del proyecto
+# El grafo de Fase 5 se compila en main(): importar este módulo (p. ej. para
+# determinar_request_type) no arrastra langgraph ni langchain_openai.
+from agents.entrenador import build_graph
 from agents.graph_state import create_initial_state, GraphState
 from config.settings import Config
 from utils.logger import setup_logger
@@ -32,6 +26,17 @@ REQUEST_TYPE_KEYWORDS = {
     "registrar_ejercicio": ["registra", "anota", "ejercicio", "sentadilla", "press", "kg", "peso muerto"],
 }
 
+# Orden de prioridad: keywords específicas primero, generales al final
+REQUEST_TYPE_PRIORITY = ("consultar_historial", "registrar_ejercicio", "crear_rutina")
+
+# Una regex precompilada por tipo (alternación de keywords, sin distinguir mayúsculas):
+# un solo escaneo en C por tipo en vez de un `in` por keyword. No se combinan en una
+# sola regex porque el primer match por posición no respetaría la prioridad.
+_REQUEST_TYPE_PATTERNS = tuple(
+    (request_type, re.compile("|".join(map(re.escape, REQUEST_TYPE_KEYWORDS[request_type])), re.IGNORECASE))
+    for request_type in REQUEST_TYPE_PRIORITY
+)
+
 def determinar_request_type(user_input: str) -> str:
     """
     Determina qué tipo de request es basado en keywords.
@@ -42,27 +47,14 @@ def determinar_request_type(user_input: str) -> str:
     Returns:
         "crear_rutina" | "registrar_ejercicio" | "consultar_historial" | "unknown"
     """
-    user_input_lower = user_input.lower()
-
-    # --- CORRECCIÓN ---
-    # Verificar tipos en orden de especificidad o prioridad
-    # 1. Consultar historial (keywords más específicas como "historial", "muéstrame")
-    if any(kw in user_input_lower for kw in REQUEST_TYPE_KEYWORDS["consultar_historial"]):
-        logger.debug(f"Input '{user_input}' clasificado como: consultar_historial")
-        return "consultar_historial"
-
-    # 2. Registrar ejercicio (keywords como "registra", "anota", "kg")
-    if any(kw in user_input_lower for kw in REQUEST_TYPE_KEYWORDS["registrar_ejercicio"]):
-        logger.debug(f"Input '{user_input}' clasificado como: registrar_ejercicio")
-        return "registrar_ejercicio"
-
-    # 3. Crear rutina (keywords más generales como "rutina", "plan")
-    if any(kw in user_input_lower for kw in REQUEST_TYPE_KEYWORDS["crear_rutina"]):
-        logger.debug(f"Input '{user_input}' clasificado como: crear_rutina")
-        return "crear_rutina"
+    # Verificar tipos en orden de prioridad (ver REQUEST_TYPE_PRIORITY)
+    for request_type, pattern in _REQUEST_TYPE_PATTERNS:
+        if pattern.search(user_input):
+            logger.debug("Input '%s' clasificado como: %s", user_input, request_type)
+            return request_type
 
     # Fallback si no coincide ninguno de los anteriores
-    logger.debug(f"Input '{user_input}' no clasificado, tipo: unknown")
+    logger.debug("Input '%s' no clasificado, tipo: unknown", user_input)
     return "unknown"
 
 def main():
@@ -75,6 +67,17 @@ def main():
     print("Comandos: 'login [user_id]' | 'exit'")
     
     user_id = None
+    thread_config = None
+
+    # Compilar el grafo (memoizado en build_graph)
+    try:
+        graph = build_graph()
+    except ImportError as e:
+        print(f"Error: No se pudo importar el grafo. ¿Están todos los nodos definidos? {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        print(f"Error compilando el grafo: {e}", file=sys.stderr)
+        sys.exit(1)
     
     # Validar que USERS_DIR existe (buena práctica)
     if not Config.USERS_DIR.exists():
@@ -106,6 +109,12 @@ def main():
                     user_file = Config.USERS_DIR / f"{new_user_id}.json"
                     if user_file.exists():
                         user_id = new_user_id
+                        # Configuración de checkpoint (una por sesión de login)
+                        thread_config = {
+                            "configurable": {
+                                "thread_id": f"user_session_{user_id}_{datetime.now().timestamp()}"
+                            }
+                        }
                         print(f"✅ Logueado como: {user_id}")
                         logger.info(f"Usuario logueado: {user_id}")
                     else:
@@ -132,11 +141,8 @@ def main():
 
             # 5. Invocar el grafo
             logger.info(f"Invocando grafo para {user_id} | Tipo: {request_type} | Msg: '{user_input}'")
-            
-            # Configuración de checkpoint (opcional pero bueno para debug)
-            config = {"configurable": {"thread_id": f"user_session_{user_id}_{datetime.now().timestamp()}"}}
 
-            final_state: GraphState = graph.invoke(initial_state, config=config)
+            final_state: GraphState = graph.invoke(initial_state, config=thread_config)
 
             # 6. Mostrar resultado
             if final_state.get("error"):
@@ -129,6 +129,36 @@ def create_valid_routine(principles: PrincipiosExtraidos | Dict[str, Any], user_
 
 # --- Fixtures ---
 
+@pytest.fixture(autouse=True)
+def clear_node_caches():
+    """Limpia las cachés en memoria de los nodos para aislar cada test."""
+    import importlib
+    import sys
+    import agents.nodes  # noqa: F401  (asegura que los submódulos estén cargados)
+
+    extract_module = sys.modules["agents.nodes.extract_principles"]
+    generate_module = sys.modules["agents.nodes.generate_routine"]
+    legacy_module = importlib.import_module("agents.nodes.legacy")
+    caches = (
+        extract_module._get_chain,
+        extract_module._cached_extract,
+        generate_module._get_cached_config,
+        generate_module._get_chain_components,
+        generate_module._get_llm,
+        generate_module._get_routine_chain,
+        legacy_module._get_parse_chain,
+        legacy_module._get_user_context,
+        legacy_module._cached_llm_parse,
+    )
+    for cached in caches:
+        cached.cache_clear()
+    generate_module._ROUTINE_CACHE.clear()
+    yield
+    for cached in caches:
+        cached.cache_clear()
+    generate_module._ROUTINE_CACHE.clear()
+
+
 @pytest.fixture
 def empty_graph_state() -> GraphState:
     """Provides an empty/initial GraphState dictionary."""
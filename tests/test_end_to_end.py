@@ -233,6 +233,20 @@ def test_determinar_request_type(user_input, expected_type):
     assert determinar_request_type(user_input) == expected_type
 
 
+def test_build_graph_memoizado(graph_compiled):
+    """
+    Valida que el grafo se compila una sola vez por proceso.
+
+    POR QUÉ FUNCIONA:
+    - build_graph() está memoizado con lru_cache
+    - El `graph` exportado perezosamente es la misma instancia
+    """
+    from agents import entrenador
+
+    assert entrenador.build_graph() is entrenador.build_graph()
+    assert entrenador.graph is graph_compiled
+
+
 def test_e2e_crear_rutina_flow(graph_compiled, user_e2e_profile, mock_crg_nodes, temp_project_dirs):
     """
     Test E2E (Happy Path): Flujo C-R-G completo.
@@ -306,6 +320,25 @@ def test_e2e_registrar_ejercicio_flow(graph_compiled, user_e2e_profile, temp_pro
     assert historial_data[0]["peso_kg"] == 100.0
 
 
+def test_e2e_registrar_ejercicio_estructurado(graph_compiled, user_e2e_profile, temp_project_dirs):
+    """
+    Test E2E: registro con ejercicio_data ya estructurado en el estado.
+    El mensaje no es parseable, así que solo pasa si se omite el parseo (regex/LLM).
+    """
+    user_id = user_e2e_profile
+    initial_state = create_initial_state(user_id, "registrar_ejercicio")
+    initial_state["user_message"] = "registro desde formulario"
+    initial_state["ejercicio_data"] = {
+        "ejercicio": "press de banca", "series": 4, "repeticiones": 8, "peso_kg": 60.0
+    }
+
+    final_state = graph_compiled.invoke(initial_state)
+
+    assert final_state["error"] is None, f"Hubo un error inesperado: {final_state['error']}"
+    assert final_state["step_completed"] == "call_legacy_register"
+    assert "Registrado: press de banca - 4x8" in final_state["respuesta_usuario"]
+
+
 def test_e2e_consultar_historial_flow(graph_compiled, user_e2e_profile):
     """
     Test E2E (Happy Path): Flujo Legacy Query.
@@ -1,3 +1,3 @@
-from .helpers import ensure_data_dir, init_historial
+from .helpers import ensure_data_dir, init_historial, json_loads, json_dumps_pretty, atomic_write
 
-__all__ = ["ensure_data_dir", "init_historial"]
\ No newline at end of file
+__all__ = ["ensure_data_dir", "init_historial", "json_loads", "json_dumps_pretty", "atomic_write"]
\ No newline at end of file
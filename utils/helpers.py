@@ -3,6 +3,58 @@ Funciones auxiliares
 """
 import json
 import os
+import shutil
+import tempfile
+from contextlib import contextmanager, suppress
+from pathlib import Path
+
+# orjson (extensión C) es opcional: si no está instalado se usa json estándar
+# con el mismo formato de salida (indent=2, UTF-8 sin escapar).
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def json_loads(data):
+    """Parsea JSON desde bytes o str. JSON inválido lanza ValueError."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def json_dumps_pretty(obj) -> bytes:
+    """Serializa a bytes UTF-8 con indentación de 2 espacios (formato de los JSON de data/)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+@contextmanager
+def atomic_write(path: Path):
+    """
+    Escritura atómica en binario: se escribe en un temporal único junto al
+    destino (<name>.<aleatorio>.tmp), se hace fsync y se sustituye el destino
+    con os.replace. El nombre único evita que dos escritores del mismo archivo
+    compartan temporal. Si algo falla, el destino queda intacto y el temporal
+    se elimina antes de propagar la excepción.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp")
+    tmp_path = Path(tmp_name)
+    try:
+        with open(fd, "wb") as f:
+            # mkstemp crea el archivo con permisos 0600: conservar los del destino
+            with suppress(FileNotFoundError):
+                shutil.copymode(path, tmp_path)
+            yield f
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        with suppress(OSError):  # no ocultar el error original
+            tmp_path.unlink(missing_ok=True)
+        raise
+
 
 def ensure_data_dir():
     """Asegura que existe el directorio data/"""
@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 import sys # Importa sys
@@ -41,3 +42,32 @@ def setup_logger(name: str, log_file: str = None, level=logging.INFO) -> logging
     logger.addHandler(console_handler)
 
     return logger
+
+
+def log_node(name: str):
+    """
+    Decorador para nodos del grafo: traza "--- Entering/Exiting {name} Node ---".
+
+    Las trazas van a DEBUG en el logger del módulo del nodo y solo se emiten si ese
+    nivel está activo; la salida se registra en un finally (también en returns tempranos).
+    """
+    enter_msg = f"--- Entering {name} Node ---"
+    exit_msg = f"--- Exiting {name} Node ---"
+
+    def decorator(fn):
+        node_logger = logging.getLogger(fn.__module__)
+
+        @functools.wraps(fn)
+        def wrapper(state):
+            debug = node_logger.isEnabledFor(logging.DEBUG)
+            if debug:
+                node_logger.debug(enter_msg)
+            try:
+                return fn(state)
+            finally:
+                if debug:
+                    node_logger.debug(exit_msg)
+
+        return wrapper
+
+    return decorator